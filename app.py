@@ -1,59 +1,625 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context, url_for
+import json
 import os
-from werkzeug.utils import secure_filename
-from disease_detector import DiseaseDetector
-from treatment_advisor import TreatmentAdvisor
+import threading
+import time
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from werkzeug.exceptions import HTTPException
+from disease_detector import DiseaseDetector, content_key
+from treatment_advisor import TreatmentAdvisor, DEFAULT_SPRAY_VOLUME_PER_ACRE
+from catalogue import CatalogueWatcher
+from result_cache import ResultCache
+from near_duplicates import NearDuplicateIndex
+from knn_classifier import KNNClassifier
+from upload_store import UploadStore
+from inference_pool import InferencePool, LocalAnalyzer, PoolBusyError, JobTimeoutError
+from job_store import JobStore, SharedJobStore, QueueFullError
+from metrics import MetricsRegistry, StageTimer
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
+app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+app.config['UPLOAD_MAX_DIMENSION'] = 1600  # Longest side browsers shrink photos to before uploading
+app.config['UPLOAD_QUALITY'] = 0.85  # Browser WebP/JPEG recompression quality (0-1)
+app.config['SAVE_UPLOADS'] = True  # Keep a copy of each upload in UPLOAD_FOLDER
+app.config['UPLOAD_MAX_BYTES'] = int(os.environ.get('UPLOAD_MAX_BYTES', 2 * 1024 ** 3))  # Stored uploads are trimmed, oldest first, to this size
+app.config['UPLOAD_MAX_AGE'] = 30 * 24 * 3600  # Seconds a stored upload is kept after its last upload
+app.config['UPLOAD_SWEEP_INTERVAL'] = 600  # Seconds between eviction sweeps of UPLOAD_FOLDER
+app.config['UPLOAD_WRITE_MAX_PENDING'] = 64 * 1024 * 1024  # Bytes of uploads waiting to be stored; past it new copies are skipped
+app.config['RESULT_CACHE_SIZE'] = 2048  # Detection results kept in memory
+app.config['RESULT_CACHE_TTL'] = 7 * 24 * 3600  # Seconds before a cached result expires
+app.config['RESULT_CACHE_DB'] = os.environ.get('RESULT_CACHE_DB')  # Optional SQLite file
+app.config['ANALYSIS_MAX_PIXELS'] = None  # Downsample larger images first; pick with resolution_report.py
+app.config['ANALYSIS_REUSE_BUFFERS'] = True  # Per-thread preallocated buffers for feature extraction
+app.config['ANALYSIS_CROP_LEAF'] = True  # Analyze only the leaf's bounding box; the mask is returned to the UI
+app.config['NEAR_DUPLICATE_DISTANCE'] = 4  # Perceptual-hash bits (of 64) within which a photo reuses a recent diagnosis; None = off
+app.config['NEAR_DUPLICATE_MAX_AGE'] = 600  # Seconds a diagnosis stays reusable for near-identical photos
+app.config['NEAR_DUPLICATE_MAX_ENTRIES'] = 50000  # Recent perceptual hashes kept per analyzing process
+app.config['KNN_MODEL'] = os.environ.get('KNN_MODEL')  # Optional .npz from knn_classifier.py; replaces the scoring rules
+app.config['INFERENCE_WORKERS'] = int(os.environ.get('INFERENCE_WORKERS', os.cpu_count() or 1))  # 0 = analyze in-process
+app.config['INFERENCE_MAX_PENDING'] = int(os.environ.get('INFERENCE_MAX_PENDING', 0)) or None  # Default: 4 per worker (4 in-process)
+app.config['INFERENCE_TIMEOUT'] = 30  # Seconds per analysis job
+app.config['INFERENCE_RETRY_AFTER'] = 2  # Seconds clients should wait when the queue is full
+app.config['JOB_TTL'] = 600  # Seconds a finished diagnosis job stays retrievable
+app.config['JOB_MAX_ACTIVE'] = 64  # Queued + running jobs before /api/jobs answers 503
+app.config['JOB_STALE_AFTER'] = app.config['INFERENCE_TIMEOUT'] + 30  # Seconds without progress before a shared unfinished job is presumed dead (its process exited)
+app.config['JOB_KEEPALIVE'] = 15  # Seconds between SSE keep-alive comments
+app.config['JOB_STORE_DB'] = os.environ.get('JOB_STORE_DB')  # SQLite file sharing jobs between server processes; None = in-process
+app.config['TREATMENT_PLAN_MAX_ROWS'] = 1000  # Rows accepted by one bulk spray-plan request
+app.config['CATALOGUE_RELOAD_INTERVAL'] = float(os.environ.get('CATALOGUE_RELOAD_INTERVAL', 2))  # Seconds; 0 = no hot reload
+app.config['CATALOGUE_MAX_AGE'] = 300  # Seconds browsers/CDNs may reuse catalogue lookups before revalidating
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'  # Serve /metrics
 
-# Initialize modules
-detector = DiseaseDetector()
-advisor = TreatmentAdvisor()
+# Prometheus metrics; per-stage analysis timings are only collected when enabled
+metrics = MetricsRegistry()
+metrics.histogram('analysis_stage_seconds', 'Time spent in each image analysis stage')
+metrics.histogram('http_request_duration_seconds', 'Request latency by route')
+metrics.counter('http_requests_total', 'Requests by route, method and status')
+metrics.counter('upload_writes_skipped_total', 'Uploads not stored because the write backlog was full')
+
+def record_stage(stage, seconds):
+    metrics.observe('analysis_stage_seconds', seconds, {'stage': stage})
+
+stage_recorder = record_stage if app.config['METRICS_ENABLED'] else None
+request_timer = StageTimer(stage_recorder)
+
+# Initialize modules; the catalogue is loaded and validated once, then shared
+catalogue_watcher = CatalogueWatcher(interval=app.config['CATALOGUE_RELOAD_INTERVAL'])
+result_cache = ResultCache(
+    max_entries=app.config['RESULT_CACHE_SIZE'],
+    ttl_seconds=app.config['RESULT_CACHE_TTL'],
+    db_path=app.config['RESULT_CACHE_DB']
+)
+
+def near_duplicate_index():
+    """A fresh NearDuplicateIndex per the config, or None when reuse is off"""
+    if app.config['NEAR_DUPLICATE_DISTANCE'] is None:
+        return None
+    return NearDuplicateIndex(
+        max_distance=app.config['NEAR_DUPLICATE_DISTANCE'],
+        max_entries=app.config['NEAR_DUPLICATE_MAX_ENTRIES'],
+        max_age_seconds=app.config['NEAR_DUPLICATE_MAX_AGE']
+    )
+
+# Labelled-example classifier, loaded once and shared by the detector and pool workers
+classifier = KNNClassifier.load(app.config['KNN_MODEL']) if app.config['KNN_MODEL'] else None
+detector = DiseaseDetector(
+    cache=result_cache,
+    max_pixels=app.config['ANALYSIS_MAX_PIXELS'],
+    stage_recorder=stage_recorder,
+    reuse_buffers=app.config['ANALYSIS_REUSE_BUFFERS'],
+    crop_leaf=app.config['ANALYSIS_CROP_LEAF'],
+    catalogue=catalogue_watcher.current,
+    near_duplicates=near_duplicate_index(),
+    classifier=classifier
+)
+advisor = TreatmentAdvisor(catalogue=catalogue_watcher.current)
+
+# CPU-bound analysis runs in worker processes, each with its own detector
+inference_pool = None
+if app.config['INFERENCE_WORKERS'] > 0:
+    inference_pool = InferencePool(
+        workers=app.config['INFERENCE_WORKERS'],
+        max_pending=app.config['INFERENCE_MAX_PENDING'],
+        timeout=app.config['INFERENCE_TIMEOUT'],
+        cache=result_cache,
+        detector_options={
+            'max_pixels': app.config['ANALYSIS_MAX_PIXELS'],
+            'reuse_buffers': app.config['ANALYSIS_REUSE_BUFFERS'],
+            'crop_leaf': app.config['ANALYSIS_CROP_LEAF'],
+            'classifier': classifier
+        },
+        stage_recorder=stage_recorder,
+        # Looked up here, before submitting, so a burst spread over several
+        # workers still reuses the first shot's diagnosis. It is not the
+        # detector's index: the pool hashes a reduced decode of the upload,
+        # the detector the full one, and the two hashes are not comparable.
+        near_duplicates=near_duplicate_index()
+    )
+    inference_pool.set_catalogue(catalogue_watcher.current)
+    if inference_pool.near_duplicates is not None:
+        inference_pool.near_duplicates.set_version(detector.rules_version)
+# Either way admission is bounded, and a full queue answers 503 with Retry-After
+analyzer = inference_pool or LocalAnalyzer(detector, max_pending=app.config['INFERENCE_MAX_PENDING'])
+
+def apply_catalogue(snapshot):
+    """Swap a freshly reloaded catalogue into everything that serves requests"""
+    detector.set_catalogue(snapshot)
+    advisor.set_catalogue(snapshot)
+    if inference_pool is not None:
+        inference_pool.set_catalogue(snapshot)
+        # Workers share the detector's options, so their results carry its rules_version
+        if inference_pool.near_duplicates is not None:
+            inference_pool.near_duplicates.set_version(detector.rules_version)
+
+catalogue_watcher.subscribe(apply_catalogue)
+
+# Warm-up state per serving process; /readyz answers 200 only once it has run
+readiness = {'started': False, 'ready': False, 'warm_up_seconds': None, 'error': None}
+readiness_lock = threading.Lock()
+
+def warm_up_image():
+    """Small JPEG of a green leaf with brown spots, exercising decode and every analysis stage"""
+    img = np.full((480, 640, 3), (40, 70, 110), dtype=np.uint8)
+    cv2.ellipse(img, (320, 240), (250, 150), 15, 0, 360, (40, 150, 60), -1)
+    for x, y in ((250, 200), (360, 260), (420, 210)):
+        cv2.circle(img, (x, y), 18, (30, 60, 120), -1)
+    return cv2.imencode('.jpg', img)[1].tobytes()
+
+def warm_up():
+    """
+    Per-process start-up, run once after any fork: start background threads
+    and push a synthetic image through the whole analysis path so the first
+    real request is not the one paying for lazy initialization
+    """
+    with readiness_lock:
+        if readiness['started']:
+            return
+        readiness['started'] = True
+    
+    start = time.perf_counter()
+    try:
+        if app.config['CATALOGUE_RELOAD_INTERVAL'] > 0:
+            catalogue_watcher.start()
+        if app.config['SAVE_UPLOADS']:
+            upload_store.start()
+        
+        image = warm_up_image()
+        if inference_pool is not None:
+            inference_pool.warm_up(image)
+        elif detector.analyze_image(image) is None:
+            raise RuntimeError('Warm-up image could not be analyzed')
+        
+        readiness['warm_up_seconds'] = round(time.perf_counter() - start, 3)
+        readiness['ready'] = True
+    except Exception as e:
+        readiness['error'] = f'{type(e).__name__}: {e}'
+
+@app.before_request
+def ensure_warm_up():
+    # Servers without a post-fork hook (or the dev server) warm up on the first request
+    if not readiness['started']:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+# Asynchronous diagnosis jobs; runner threads only wait on the analyzer. With
+# several server processes jobs live in a shared SQLite file, so any process
+# can answer polls and event streams for a job another one is running.
+if app.config['JOB_STORE_DB']:
+    jobs = SharedJobStore(
+        app.config['JOB_STORE_DB'],
+        ttl_seconds=app.config['JOB_TTL'],
+        max_active=app.config['JOB_MAX_ACTIVE'],
+        stale_seconds=app.config['JOB_STALE_AFTER']
+    )
+else:
+    jobs = JobStore(ttl_seconds=app.config['JOB_TTL'], max_active=app.config['JOB_MAX_ACTIVE'])
+job_runner = ThreadPoolExecutor(max_workers=max(2, app.config['INFERENCE_WORKERS']))
+
+metrics.gauge('result_cache_hits', 'Detection result cache hits', lambda: result_cache.stats()['hits'])
+metrics.gauge('result_cache_misses', 'Detection result cache misses', lambda: result_cache.stats()['misses'])
+metrics.gauge('catalogue_reloads', 'Catalogue hot reloads since startup', lambda: catalogue_watcher.reloads)
+metrics.gauge('result_cache_entries', 'Detection results held in memory', lambda: result_cache.stats()['entries'])
+metrics.gauge('upload_store_bytes', 'Bytes of stored uploads at the last sweep', lambda: upload_store.stats()['bytes'] or 0)
+metrics.gauge('upload_store_duplicates', 'Uploads already stored byte-for-byte', lambda: upload_store.stats()['duplicates'])
+metrics.gauge('upload_store_evictions', 'Stored uploads evicted by age or size', lambda: upload_store.stats()['evictions'])
+
+if app.config['METRICS_ENABLED']:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.inc('http_requests_total', {
+            'route': route, 'method': request.method, 'status': str(response.status_code)
+        })
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - g.request_start, {
+            'route': route, 'method': request.method
+        })
+        return response
+
+# Uploads are analyzed from memory; copies are stored by content hash, off the request thread
+upload_store = UploadStore(
+    app.config['UPLOAD_FOLDER'],
+    max_bytes=app.config['UPLOAD_MAX_BYTES'],
+    max_age_seconds=app.config['UPLOAD_MAX_AGE'],
+    sweep_interval=app.config['UPLOAD_SWEEP_INTERVAL']
+)
+upload_writer = ThreadPoolExecutor(max_workers=1)
+# Bytes queued on upload_writer, whose own queue is unbounded
+upload_backlog = {'bytes': 0}
+upload_backlog_lock = threading.Lock()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def upload_settings():
+    """Preferred upload size and encoding, advertised to clients that resize before uploading"""
+    return {
+        'max_dimension': app.config['UPLOAD_MAX_DIMENSION'],
+        'max_pixels': app.config['ANALYSIS_MAX_PIXELS'],
+        'formats': ['image/webp', 'image/jpeg'],
+        'quality': app.config['UPLOAD_QUALITY']
+    }
+
+def persist_upload(data):
+    """
+    Queue a copy of the upload for the upload store if SAVE_UPLOADS is enabled.
+    If the disk falls behind and UPLOAD_WRITE_MAX_PENDING bytes are already
+    queued, the copy is skipped rather than held in memory.
+    """
+    if not app.config['SAVE_UPLOADS']:
+        return
+    with upload_backlog_lock:
+        if upload_backlog['bytes'] + len(data) > app.config['UPLOAD_WRITE_MAX_PENDING']:
+            metrics.inc('upload_writes_skipped_total')
+            return
+        upload_backlog['bytes'] += len(data)
+    upload_writer.submit(store_upload, data)
+
+def store_upload(data):
+    """Write one queued upload (runs on upload_writer)"""
+    try:
+        upload_store.put(data)
+    finally:
+        with upload_backlog_lock:
+            upload_backlog['bytes'] -= len(data)
+
+def catalogue_response(kind, disease_id):
+    """
+    Serve a pre-serialized catalogue lookup with a strong ETag; conditional
+    GETs whose If-None-Match still matches get 304 Not Modified
+    Returns: Response, or None if the catalogue has no entry for disease_id
+    """
+    entry = catalogue_watcher.current.responses.get((kind, disease_id))
+    if entry is None:
+        return None
+    
+    body, etag = entry
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['CATALOGUE_MAX_AGE']
+    return response.make_conditional(request)
+
+BUSY_MESSAGE = 'Server is busy analyzing other images. Please retry shortly.'
+
+def busy_response():
+    """503 telling the client to back off while the analysis queue is full"""
+    response = jsonify({'error': BUSY_MESSAGE})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['INFERENCE_RETRY_AFTER'])
+    return response
+
+def analysis_error(error):
+    """Returns: (message, HTTP status) for an exception raised while analyzing"""
+    if isinstance(error, PoolBusyError):
+        return BUSY_MESSAGE, 503
+    if isinstance(error, JobTimeoutError):
+        return str(error), 504
+    return f'Error processing image: {str(error)}', 500
+
+def analysis_route(view):
+    """Answer analysis failures with a JSON error: 503 + Retry-After when busy, 504 on timeout, else 500"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        except (UploadError, HTTPException):
+            # Answered by their own error handlers
+            raise
+        except PoolBusyError:
+            return busy_response()
+        except Exception as e:
+            message, status = analysis_error(e)
+            return jsonify({'error': message}), status
+    return wrapper
+
+class UploadError(Exception):
+    """Raised for a request without a usable image upload; answered with 400"""
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    return jsonify({'error': str(e)}), 400
+
+def read_upload():
+    """
+    Read the 'image' file of the request into memory and queue a stored copy
+    Returns: Image bytes
+    Raises: UploadError if no acceptable image was sent
+    """
+    if 'image' not in request.files:
+        raise UploadError('No image file provided')
+    
+    file = request.files['image']
+    
+    if file.filename == '':
+        raise UploadError('No file selected')
+    
+    if not allowed_file(file.filename):
+        raise UploadError('Invalid file type. Please upload an image file.')
+    
+    # Decoded straight from memory, never from the stored copy
+    with request_timer.stage('read_upload'):
+        data = file.read()
+    persist_upload(data)
+    return data
+
+def treatment_options():
+    """
+    Dosage inputs sent with a diagnosis request
+    Returns: dict of motor_capacity, water_amount (floats or None) and chemical_name
+    Raises: UploadError for non-numeric amounts
+    """
+    motor_capacity = request.form.get('motor_capacity')
+    water_amount = request.form.get('water_amount')
+    try:
+        motor_capacity = float(motor_capacity) if motor_capacity else None
+        water_amount = float(water_amount) if water_amount else None
+    except ValueError:
+        raise UploadError('Invalid numeric values')
+    return {
+        'motor_capacity': motor_capacity,
+        'water_amount': water_amount,
+        'chemical_name': request.form.get('chemical_name') or None
+    }
+
+def treatments_for(disease_id, motor_capacity=None, water_amount=None, chemical_name=None):
+    """
+    Organic recipe and inorganic options for a detected disease and, when
+    motor_capacity is given, the dosage for chemical_name (default: the first option)
+    """
+    inorganic = advisor.get_inorganic_options(disease_id)
+    treatments = {
+        'organic': advisor.get_organic_treatment(disease_id),
+        'inorganic': inorganic
+    }
+    
+    chemicals = inorganic.get('available_chemicals')
+    if motor_capacity and chemicals:
+        treatments['default_dosage'] = advisor.calculate_inorganic_dosage(
+            disease_id, chemical_name or chemicals[0]['name'], motor_capacity, water_amount
+        )
+    return treatments
+
+def run_job(job_id, data, options):
+    """Analyze an uploaded image for a queued job and look up its treatments"""
+    jobs.start(job_id)
+    deadline = time.time() + app.config['INFERENCE_TIMEOUT']
+    
+    while True:
+        try:
+            result = analyzer.analyze_image(data)
+            break
+        except PoolBusyError as e:
+            # Jobs wait for a free worker instead of failing like sync uploads
+            if time.time() >= deadline:
+                jobs.fail(job_id, analysis_error(e)[0])
+                return
+            time.sleep(app.config['INFERENCE_RETRY_AFTER'])
+        except Exception as e:
+            jobs.fail(job_id, analysis_error(e)[0])
+            return
+    
+    if result is None:
+        jobs.fail(job_id, 'Failed to analyze image')
+        return
+    
+    try:
+        treatments = treatments_for(result['disease_id'], **options)
+    except Exception as e:
+        jobs.fail(job_id, analysis_error(e)[0])
+        return
+    jobs.finish(job_id, {'detection': result, 'treatments': treatments})
+
+def job_view(job):
+    """Public representation of a diagnosis job; finished jobs carry what /api/diagnose returns"""
+    view = {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'status_url': url_for('get_job', job_id=job['job_id']),
+        'events_url': url_for('get_job_events', job_id=job['job_id'])
+    }
+    if job['status'] == 'done':
+        view.update(job['result'])
+    elif job['status'] == 'failed':
+        view['error'] = job['error']
+    return view
+
 @app.route('/')
 def index():
     """Render main application page"""
-    return render_template('index.html')
+    # Upload settings are embedded so the page needs no extra request for them
+    return render_template('index.html', upload_settings=upload_settings())
+
+@app.route('/api/upload/settings')
+def get_upload_settings():
+    """Preferred maximum dimension and encodings for uploads"""
+    response = jsonify(upload_settings())
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['CATALOGUE_MAX_AGE']
+    return response
 
 @app.route('/api/upload', methods=['POST'])
+@analysis_route
 def upload_image():
     """Handle image upload and disease detection"""
-    if 'image' not in request.files:
-        return jsonify({'error': 'No image file provided'}), 400
+    data = read_upload()
     
-    file = request.files['image']
+    # Detect disease
+    result = analyzer.analyze_image(data)
     
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+    if result is None:
+        return jsonify({'error': 'Failed to analyze image'}), 500
     
-    if not allowed_file(file.filename):
-        return jsonify({'error': 'Invalid file type. Please upload an image file.'}), 400
+    return jsonify({
+        'success': True,
+        'detection': result
+    })
+
+@app.route('/api/diagnose', methods=['POST'])
+@analysis_route
+def diagnose():
+    """
+    Detect the disease and return its treatments in one round trip: the
+    organic recipe, the inorganic options and, when motor_capacity is
+    given, the dosage for chemical_name (default: the first option)
+    """
+    options = treatment_options()
+    data = read_upload()
+    
+    result = analyzer.analyze_image(data)
+    
+    if result is None:
+        return jsonify({'error': 'Failed to analyze image'}), 500
+    
+    return jsonify({
+        'success': True,
+        'detection': result,
+        'treatments': treatments_for(result['disease_id'], **options)
+    })
+
+@app.route('/api/upload/batch', methods=['POST'])
+@analysis_route
+def upload_batch():
+    """Handle multi-image upload and batch disease detection"""
+    files = request.files.getlist('images')
+
+    if not files:
+        return jsonify({'error': 'No image files provided'}), 400
+
+    results = [{'filename': file.filename} for file in files]
+    analyzed = []
+
+    # Invalid uploads are reported per image
+    for index, file in enumerate(files):
+        if file.filename == '' or not allowed_file(file.filename):
+            results[index]['error'] = 'Invalid file type. Please upload an image file.'
+        else:
+            analyzed.append(index)
+
+    def read_uploads():
+        # Read lazily so analyze_batch only holds one chunk of images at a time
+        for index in analyzed:
+            data = files[index].read()
+            persist_upload(data)
+            yield data
+
+    # Detect disease for the whole batch
+    for index, detection in zip(analyzed, analyzer.analyze_batch(read_uploads())):
+        if 'error' in detection:
+            results[index]['error'] = detection['error']
+        else:
+            results[index]['detection'] = detection
+
+    return jsonify({
+        'success': True,
+        'results': results
+    })
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """
+    Queue an uploaded image for diagnosis and return the job id immediately.
+    Accepts the same treatment fields as /api/diagnose; the finished job
+    carries the detection and treatments.
+    """
+    options = treatment_options()
+    data = read_upload()
     
+    # Re-submitting the same image with the same fields joins the existing job
+    key = f"{content_key(data)[1]}:{json.dumps(options, sort_keys=True)}"
     try:
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Detect disease
-        result = detector.analyze_image(filepath)
-        
-        if result is None:
-            return jsonify({'error': 'Failed to analyze image'}), 500
-        
-        return jsonify({
-            'success': True,
-            'detection': result
-        })
+        job, created = jobs.create(key=key)
+    except QueueFullError:
+        return busy_response()
     
-    except Exception as e:
-        return jsonify({'error': f'Error processing image: {str(e)}'}), 500
+    if created:
+        job_runner.submit(run_job, job['job_id'], data, options)
+    
+    response = jsonify(job_view(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('get_job', job_id=job['job_id'])
+    return response
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Poll the status of a diagnosis job"""
+    job = jobs.get(job_id)
+    
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    
+    return jsonify(job_view(job))
+
+@app.route('/api/jobs/<job_id>/events')
+def get_job_events(job_id):
+    """Stream job status changes as server-sent events until it finishes"""
+    if jobs.get(job_id) is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    
+    def stream():
+        version = -1
+        while True:
+            job = jobs.wait(job_id, version, timeout=app.config['JOB_KEEPALIVE'])
+            if job is None:
+                yield 'event: failed\ndata: {"error": "Job not found or expired"}\n\n'
+                return
+            
+            if job['version'] == version:
+                # Comment line keeps idle proxies from closing the stream
+                yield ': keep-alive\n\n'
+                continue
+            
+            version = job['version']
+            yield f"event: {job['status']}\ndata: {json.dumps(job_view(job))}\n\n"
+            if job['status'] in ('done', 'failed'):
+                return
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once this process has finished its warm-up analysis, 503 before"""
+    body = {
+        'ready': readiness['ready'],
+        'catalogue_version': catalogue_watcher.current.version,
+        'warm_up_seconds': readiness['warm_up_seconds'],
+        'error': readiness['error']
+    }
+    return jsonify(body), 200 if readiness['ready'] else 503
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics: request latency, analysis stage timings, cache counters"""
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    """Get detection result cache hit/miss counters"""
+    return jsonify(result_cache.stats())
+
+@app.route('/api/catalogue')
+def get_catalogue_status():
+    """Current catalogue version, when it was loaded, and the last failed reload if any"""
+    return jsonify(catalogue_watcher.status())
 
 @app.route('/api/treatment/organic', methods=['POST'])
 def get_organic_treatment():
@@ -64,6 +630,15 @@ def get_organic_treatment():
     if not disease_id:
         return jsonify({'error': 'Disease ID is required'}), 400
     
+    return get_organic_treatment_by_id(disease_id)
+
+@app.route('/api/treatment/organic/<disease_id>')
+def get_organic_treatment_by_id(disease_id):
+    """Cacheable GET form of the organic recipe lookup"""
+    response = catalogue_response('organic', disease_id)
+    if response is not None:
+        return response
+    
     treatment = advisor.get_organic_treatment(disease_id)
     return jsonify(treatment)
 
@@ -76,6 +651,15 @@ def get_inorganic_options():
     if not disease_id:
         return jsonify({'error': 'Disease ID is required'}), 400
     
+    return get_inorganic_options_by_id(disease_id)
+
+@app.route('/api/treatment/inorganic/options/<disease_id>')
+def get_inorganic_options_by_id(disease_id):
+    """Cacheable GET form of the inorganic options lookup"""
+    response = catalogue_response('inorganic_options', disease_id)
+    if response is not None:
+        return response
+    
     options = advisor.get_inorganic_options(disease_id)
     return jsonify(options)
 
@@ -110,19 +694,45 @@ def calculate_inorganic_dosage():
     
     return jsonify(result)
 
+@app.route('/api/treatment/inorganic/plan', methods=['POST'])
+def plan_inorganic_spraying():
+    """Calculate dosages, tank fills and totals for many fields in one request"""
+    data = request.get_json(silent=True) or {}
+    rows = data.get('rows')
+    
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'error': 'rows must be a non-empty list'}), 400
+    if len(rows) > app.config['TREATMENT_PLAN_MAX_ROWS']:
+        return jsonify({
+            'error': f"At most {app.config['TREATMENT_PLAN_MAX_ROWS']} rows per request"
+        }), 413
+    
+    spray_volume = data.get('spray_volume_per_acre')
+    try:
+        # Only a missing value takes the default; an explicit 0 is an error
+        spray_volume = float(DEFAULT_SPRAY_VOLUME_PER_ACRE if spray_volume is None else spray_volume)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid numeric values'}), 400
+    if not np.isfinite(spray_volume):
+        return jsonify({'error': 'Invalid numeric values'}), 400
+    if spray_volume <= 0:
+        return jsonify({'error': 'spray_volume_per_acre must be positive'}), 400
+    
+    return jsonify(advisor.plan_spray_batch(rows, spray_volume))
+
 @app.route('/api/disease/<disease_id>')
 def get_disease_info(disease_id):
     """Get detailed information about a specific disease"""
-    info = detector.get_disease_info(disease_id)
-    
-    if info is None:
+    response = catalogue_response('disease', disease_id)
+    if response is None:
         return jsonify({'error': 'Disease not found'}), 404
     
-    return jsonify(info)
+    return response
 
 if __name__ == '__main__':
     # Create upload folder if it doesn't exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
-    # Run the app
+    # Development server; use gunicorn (see gunicorn.conf.py) in production
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,249 @@
+"""
+Benchmark Suite
+Times the detection and treatment hot paths on synthetic leaf images, so no
+network or dataset is needed. Results can be saved as a JSON baseline and
+later runs compared against it, failing when a path regresses.
+
+Usage:
+    python benchmark.py --save benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json --threshold 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+
+# Benchmark the web endpoints in-process, without worker processes
+os.environ.setdefault('INFERENCE_WORKERS', '0')
+
+RESOLUTIONS = {
+    '0.3MP': (480, 640),
+    '2MP': (1200, 1600),
+    '12MP': (3000, 4000),
+}
+QUICK_RESOLUTIONS = ['0.3MP', '2MP']
+
+# Fraction of the leaf covered by lesions
+LESION_DENSITIES = {
+    'clean': 0.0,
+    'light': 0.05,
+    'heavy': 0.3,
+}
+
+def synthetic_leaf(height, width, lesion_density, seed=0):
+    """
+    Draw a green leaf on a soil background with brown, yellow, white and
+    dark lesions covering roughly lesion_density of the leaf area
+    """
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = (40, 70, 110)  # Soil (BGR)
+    img += rng.integers(0, 20, size=img.shape, dtype=np.uint8)
+
+    center = (width // 2, height // 2)
+    axes = (int(width * 0.4), int(height * 0.3))
+    cv2.ellipse(img, center, axes, 15, 0, 360, (40, 150, 60), -1)
+
+    leaf_area = np.pi * axes[0] * axes[1]
+    lesion_colors = [(30, 60, 120), (40, 200, 220), (235, 235, 235), (20, 25, 30)]
+    covered = 0.0
+    while covered < leaf_area * lesion_density:
+        radius = int(rng.integers(max(2, width // 200), max(3, width // 40)))
+        x = int(center[0] + rng.uniform(-0.8, 0.8) * axes[0])
+        y = int(center[1] + rng.uniform(-0.6, 0.6) * axes[1])
+        color = lesion_colors[int(rng.integers(len(lesion_colors)))]
+        cv2.circle(img, (x, y), radius, color, -1)
+        covered += np.pi * radius * radius
+
+    return img
+
+def time_call(fn, repeat, warmup=1):
+    """Run fn repeatedly and return timing stats in milliseconds"""
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'median_ms': round(statistics.median(samples), 4),
+        'min_ms': round(min(samples), 4),
+        'repeat': repeat
+    }
+
+def bench_detector(results, resolutions, repeat):
+    """Feature extraction, scoring and end-to-end analysis per resolution and lesion density"""
+    from disease_detector import DiseaseDetector
+
+    detector = DiseaseDetector()
+    pooled = DiseaseDetector(reuse_buffers=True)
+    for res_name in resolutions:
+        height, width = RESOLUTIONS[res_name]
+        for density_name, density in LESION_DENSITIES.items():
+            img = synthetic_leaf(height, width, density)
+            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            encoded = cv2.imencode('.jpg', img)[1].tobytes()
+            features = detector._extract_features(img, hsv, None)
+            suffix = f'{res_name}/{density_name}'
+
+            results[f'extract_features/{suffix}'] = time_call(
+                lambda: detector._extract_features(img, hsv, None), repeat)
+            results[f'classify_disease/{suffix}'] = time_call(
+                lambda: detector._classify_disease(features), repeat * 20)
+            results[f'analyze_image/{suffix}'] = time_call(
+                lambda: detector.analyze_image(encoded), repeat)
+            results[f'analyze_image_reuse/{suffix}'] = time_call(
+                lambda: pooled.analyze_image(encoded), repeat)
+
+def bench_treatment(results, repeat):
+    """Inorganic dosage calculation, single and bulk"""
+    from treatment_advisor import TreatmentAdvisor
+
+    advisor = TreatmentAdvisor()
+    results['calculate_inorganic_dosage'] = time_call(
+        lambda: advisor.calculate_inorganic_dosage('leaf_blight', 'Mancozeb 75% WP', 16, 15),
+        repeat * 100)
+    
+    rows = [
+        {'disease_id': disease_id, 'chemical_name': entry['chemical']['name'],
+         'motor_capacity': 16, 'water_amount': 15, 'field_area': 0.5 + i % 7}
+        for i, ((disease_id, _), entry) in enumerate(list(advisor.catalogue.chemical_index.items()) * 84)
+    ]
+    results['plan_spray_batch/1000'] = time_call(lambda: advisor.plan_spray_batch(rows[:1000]), repeat)
+
+def bench_knn(results, repeat):
+    """Nearest-neighbour classifier over 10,000 labelled vectors, single and batched queries"""
+    from disease_detector import FEATURE_NAMES
+    from knn_classifier import KNNClassifier
+
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(0, 100, (6, len(FEATURE_NAMES)))
+    labels = rng.integers(0, len(centers), 10000)
+    vectors = centers[labels] + rng.normal(0, 10, (len(labels), len(FEATURE_NAMES)))
+    classifier = KNNClassifier(vectors, [f'disease_{label}' for label in labels])
+    queries = centers[rng.integers(0, len(centers), 1000)] + rng.normal(0, 10, (1000, len(FEATURE_NAMES)))
+
+    results['knn_predict/10000'] = time_call(lambda: classifier.predict(queries[:1]), repeat * 20)
+    results['knn_predict_batch/1000x10000'] = time_call(lambda: classifier.predict(queries), repeat)
+
+def bench_endpoints(results, repeat):
+    """Flask endpoints through the test client"""
+    import app as web
+
+    web.app.config['SAVE_UPLOADS'] = False
+    # The same photo again would be reused as a near-duplicate instead of analyzed
+    web.detector.near_duplicates = None
+    if web.inference_pool is not None:
+        web.inference_pool.near_duplicates = None
+    client = web.app.test_client()
+    encoded = cv2.imencode('.jpg', synthetic_leaf(*RESOLUTIONS['2MP'], LESION_DENSITIES['light']))[1].tobytes()
+
+    def upload():
+        # Clear the result cache so every request runs the full pipeline
+        web.result_cache.clear()
+        response = client.post('/api/upload', data={'image': (BytesIO(encoded), 'leaf.jpg')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+
+    def calculate():
+        response = client.post('/api/treatment/inorganic/calculate', json={
+            'disease_id': 'leaf_blight', 'chemical_name': 'Mancozeb 75% WP', 'motor_capacity': 16
+        })
+        assert response.status_code == 200
+
+    def disease_info():
+        assert client.get('/api/disease/leaf_blight').status_code == 200
+
+    results['endpoint/upload/2MP'] = time_call(upload, repeat)
+    results['endpoint/treatment_calculate'] = time_call(calculate, repeat * 10)
+    results['endpoint/disease_info'] = time_call(disease_info, repeat * 10)
+
+def run(quick=False, repeat=None):
+    """Run every benchmark and return the results document"""
+    repeat = repeat or (3 if quick else 7)
+    resolutions = QUICK_RESOLUTIONS if quick else list(RESOLUTIONS)
+
+    results = {}
+    bench_detector(results, resolutions, repeat)
+    bench_treatment(results, repeat)
+    bench_knn(results, repeat)
+    bench_endpoints(results, repeat)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()
+        },
+        'results': results
+    }
+
+def compare(current, baseline, threshold):
+    """
+    Compare median times against a baseline
+    Returns: List of (name, baseline_ms, current_ms, ratio) that regressed past threshold
+    """
+    regressions = []
+    for name, stats in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        ratio = stats['median_ms'] / base['median_ms'] if base['median_ms'] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append((name, base['median_ms'], stats['median_ms'], ratio))
+    return regressions
+
+def print_results(current, baseline=None):
+    """Print a table of results, with the ratio to the baseline when given"""
+    print(f"{'benchmark':<42} {'median ms':>11} {'min ms':>10} {'vs base':>9}")
+    for name, stats in current['results'].items():
+        change = ''
+        if baseline and name in baseline['results'] and baseline['results'][name]['median_ms']:
+            change = f"{stats['median_ms'] / baseline['results'][name]['median_ms']:.2f}x"
+        print(f"{name:<42} {stats['median_ms']:>11.3f} {stats['min_ms']:>10.3f} {change:>9}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark detection and treatment hot paths')
+    parser.add_argument('--quick', action='store_true', help='Fewer repeats and no 12MP images')
+    parser.add_argument('--repeat', type=int, help='Timed runs per benchmark')
+    parser.add_argument('--save', help='Write results to this JSON baseline file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown before failing, as a fraction (default 0.25)')
+    args = parser.parse_args()
+
+    current = run(quick=args.quick, repeat=args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print_results(current, baseline)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if baseline:
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}:")
+            for name, base_ms, current_ms, ratio in regressions:
+                print(f"  {name}: {base_ms:.3f} ms -> {current_ms:.3f} ms ({ratio:.2f}x)")
+            sys.exit(1)
+        print('\nNo regressions against baseline')
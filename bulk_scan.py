@@ -0,0 +1,253 @@
+"""
+Bulk Scan
+Re-analyzes a directory tree of field photos offline, across a pool of
+worker processes, streaming one result per image to JSONL or CSV as it
+finishes.
+
+A manifest next to the output records every finished image together with
+the detector's rules version. An interrupted scan started again with the
+same output resumes where it stopped. When the catalogue or classifier has
+changed since, the old results are stale and the scan must be restarted
+with --restart.
+
+Usage:
+    python -m disease_detector scan photos/ --output photos.jsonl
+    python -m disease_detector scan photos/ --output photos.csv --workers 8 --crop-leaf
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from disease_detector import FEATURE_NAMES, DiseaseDetector
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff'}
+
+CSV_FIELDS = ['path', 'disease_id', 'disease_name', 'severity', 'confidence', 'error'] + FEATURE_NAMES
+
+# Per-worker detector, set up once by the pool initializer
+_scan_detector = None
+
+def iter_images(root, extensions=IMAGE_EXTENSIONS):
+    """
+    Walk root lazily, yielding image paths relative to it in a stable
+    (per-directory sorted) order without listing the whole tree first
+    """
+    root = Path(root)
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif Path(entry.name).suffix.lower() in extensions:
+                yield Path(entry.path).relative_to(root).as_posix()
+        # Reversed so the stack visits subdirectories in sorted order
+        pending.extend(reversed(subdirectories))
+
+def read_manifest(path):
+    """
+    Returns: (rules_version, set of finished relative paths), or (None, empty set)
+             if there is no manifest yet
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            header = f.readline()
+            if not header:
+                return None, set()
+            done = {line.rstrip('\n') for line in f if line.strip()}
+    except FileNotFoundError:
+        return None, set()
+    return json.loads(header)['rules_version'], done
+
+def _init_scan_worker(detector_options):
+    global _scan_detector
+    _scan_detector = DiseaseDetector(**detector_options)
+
+def _scan_chunk(root, paths):
+    # Workers read the files themselves so only paths and results cross processes
+    results = _scan_detector.analyze_batch(str(Path(root) / path) for path in paths)
+    return list(zip(paths, results))
+
+def output_format(path, requested=None):
+    """'jsonl' or 'csv', from --format or the output file extension"""
+    if requested:
+        return requested
+    return 'csv' if Path(path).suffix.lower() == '.csv' else 'jsonl'
+
+class ResultWriter:
+    """Appends results as JSONL or CSV, flushing each one so a crash loses nothing written"""
+
+    def __init__(self, path, fmt, resume):
+        self.fmt = fmt
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8', newline='')
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(self.file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if not resume or self.file.tell() == 0:
+                self.csv.writeheader()
+
+    def write(self, path, result):
+        record = {'path': path}
+        record.update(result)
+        if self.fmt == 'csv':
+            record.update(result.get('features', {}))
+            self.csv.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def scan(root, output, fmt=None, workers=None, chunk_size=8, restart=False, detector_options=None,
+         progress=sys.stderr):
+    """
+    Analyze every image under root, appending results to output
+
+    Args:
+        root: Directory to scan recursively
+        output: Result file (.csv for CSV, anything else for JSONL unless fmt is given)
+        fmt: 'jsonl' or 'csv'
+        workers: Worker processes (defaults to the CPU count; 0 runs in-process)
+        chunk_size: Images handed to a worker at a time
+        restart: Ignore the manifest and previous results and scan everything again
+        detector_options: Keyword arguments for each worker's DiseaseDetector
+        progress: Stream for the progress line (None for silence)
+
+    Returns: Counts of analyzed, failed and skipped (already finished) images
+    """
+    detector_options = detector_options or {}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    fmt = output_format(output, fmt)
+    manifest_path = f'{output}.manifest'
+
+    # The parent's detector only provides the rules version results depend on
+    rules_version = DiseaseDetector(**detector_options).rules_version
+    manifest_version, done = (None, set()) if restart else read_manifest(manifest_path)
+    if manifest_version is not None and manifest_version != rules_version:
+        raise ValueError(
+            f'{manifest_path} was written with rules version {manifest_version}, but the current '
+            f'version is {rules_version}; run again with --restart to rescan everything'
+        )
+    resume = manifest_version is not None
+
+    writer = ResultWriter(output, fmt, resume)
+    manifest = open(manifest_path, 'a' if resume else 'w', encoding='utf-8')
+    if not resume:
+        manifest.write(json.dumps({'rules_version': rules_version, 'root': str(root)}) + '\n')
+        manifest.flush()
+
+    counts = {'analyzed': 0, 'failed': 0, 'skipped': 0}
+    start = time.perf_counter()
+    last_report = 0.0
+
+    def record(chunk_results):
+        nonlocal last_report
+        for path, result in chunk_results:
+            writer.write(path, result)
+            # Marked finished only after its result is on disk
+            manifest.write(path + '\n')
+            counts['failed' if 'error' in result else 'analyzed'] += 1
+        manifest.flush()
+
+        now = time.perf_counter()
+        if progress is not None and now - last_report >= 1.0:
+            last_report = now
+            finished = counts['analyzed'] + counts['failed']
+            progress.write(f"\r{finished} images ({counts['failed']} failed, {counts['skipped']} already done), "
+                           f"{finished / (now - start):.1f} images/s")
+            progress.flush()
+
+    def chunks():
+        chunk = []
+        for path in iter_images(root):
+            if path in done:
+                counts['skipped'] += 1
+                continue
+            chunk.append(path)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    try:
+        if workers == 0:
+            _init_scan_worker(detector_options)
+            for chunk in chunks():
+                record(_scan_chunk(root, chunk))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_scan_worker,
+                initargs=(detector_options,)
+            ) as pool:
+                # Keep only a few chunks in flight so the walk stays lazy
+                in_flight = set()
+                for chunk in chunks():
+                    in_flight.add(pool.submit(_scan_chunk, str(root), chunk))
+                    if len(in_flight) >= workers * 2:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            record(future.result())
+                for future in in_flight:
+                    record(future.result())
+    finally:
+        writer.close()
+        manifest.close()
+
+    counts['seconds'] = round(time.perf_counter() - start, 2)
+    if progress is not None:
+        finished = counts['analyzed'] + counts['failed']
+        progress.write(f"\r{finished} images ({counts['failed']} failed, {counts['skipped']} already done), "
+                       f"{finished / max(counts['seconds'], 1e-9):.1f} images/s\n")
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m disease_detector',
+                                     description='Offline disease detection tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = commands.add_parser('scan', help='Analyze every image under a directory')
+    scan_parser.add_argument('directory', help='Directory of images, scanned recursively')
+    scan_parser.add_argument('--output', '-o', default='scan_results.jsonl',
+                             help='Result file; .csv writes CSV, anything else JSONL')
+    scan_parser.add_argument('--format', choices=['jsonl', 'csv'], help='Override the output format')
+    scan_parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count, 0 = in-process)')
+    scan_parser.add_argument('--chunk-size', type=int, default=8, help='Images per worker task')
+    scan_parser.add_argument('--max-pixels', type=int, help='Downsample larger images before analysis')
+    scan_parser.add_argument('--crop-leaf', action='store_true', help='Analyze only the leaf region')
+    scan_parser.add_argument('--knn-model', help='Classify with this knn_classifier.py model instead of the rules')
+    scan_parser.add_argument('--restart', action='store_true',
+                             help='Ignore the manifest and previous results and scan everything')
+    args = parser.parse_args(argv)
+
+    if not Path(args.directory).is_dir():
+        parser.error(f'{args.directory} is not a directory')
+
+    detector_options = {'max_pixels': args.max_pixels, 'crop_leaf': args.crop_leaf, 'reuse_buffers': True}
+    if args.knn_model:
+        from knn_classifier import KNNClassifier
+        detector_options['classifier'] = KNNClassifier.load(args.knn_model)
+    try:
+        counts = scan(args.directory, args.output, fmt=args.format, workers=args.workers,
+                      chunk_size=args.chunk_size, restart=args.restart, detector_options=detector_options)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    print(json.dumps(counts))
+    return 0
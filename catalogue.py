@@ -0,0 +1,213 @@
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+# Files that make up one catalogue; the first two also decide detection results
+DETECTION_FILES = ('diseases.json', 'scoring_rules.json')
+TREATMENT_FILES = ('organic_recipes.json', 'inorganic_chemicals.json')
+
+class CatalogueSnapshot:
+    """
+    One parsed and validated version of the data/*.json catalogues. A
+    snapshot is never modified after load_catalogue builds it; reloading
+    builds a new one, so readers holding a reference always see consistent
+    disease, scoring and treatment data.
+    """
+
+    __slots__ = ('version', 'detection_version', 'loaded_at', 'stamps',
+                 'disease_data', 'diseases_by_id', 'scored_ids', 'score_weights', 'score_bias',
+                 'organic_data', 'inorganic_data', 'chemical_index', 'chemical_names', 'responses')
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CatalogueSnapshot is immutable')
+
+    def __reduce__(self):
+        # Pickled for worker processes, which then never read data/ themselves
+        return _restore_snapshot, ({name: getattr(self, name) for name in self.__slots__},)
+
+def _restore_snapshot(fields):
+    snapshot = CatalogueSnapshot(**fields)
+    snapshot.score_weights.setflags(write=False)
+    snapshot.score_bias.setflags(write=False)
+    return snapshot
+
+def serialize_response(payload):
+    """
+    Encode a JSON response body the way Flask's jsonify does (sorted keys,
+    compact separators) and derive its strong ETag from the bytes
+    Returns: (body bytes, etag without quotes)
+    """
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode() + b'\n'
+    return body, hashlib.sha256(body).hexdigest()[:32]
+
+def file_stamps(data_dir):
+    """(mtime_ns, size) of every catalogue file, used to notice edits cheaply"""
+    stamps = {}
+    for name in DETECTION_FILES + TREATMENT_FILES:
+        stat = (Path(data_dir) / name).stat()
+        stamps[name] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+def load_catalogue(data_dir=DATA_DIR):
+    """
+    Read, parse and validate every catalogue file
+
+    Returns: CatalogueSnapshot
+    Raises: OSError, ValueError (including JSON errors) if any file is missing or invalid
+    """
+    # Imported here: both modules import this one for their default catalogue
+    from disease_detector import compile_scoring_rules
+    from treatment_advisor import TreatmentAdvisor, compile_chemical_index, validate_recipes
+
+    data_dir = Path(data_dir)
+    stamps = file_stamps(data_dir)
+    raw = {name: (data_dir / name).read_bytes() for name in DETECTION_FILES + TREATMENT_FILES}
+
+    disease_data = json.loads(raw['diseases.json'])
+    diseases_by_id = {d['id']: d for d in disease_data['diseases']}
+    scored_ids, score_weights, score_bias = compile_scoring_rules(
+        json.loads(raw['scoring_rules.json'])['rules'], diseases_by_id
+    )
+    score_weights.setflags(write=False)
+    score_bias.setflags(write=False)
+
+    organic_data = json.loads(raw['organic_recipes.json'])
+    inorganic_data = json.loads(raw['inorganic_chemicals.json'])
+    validate_recipes(organic_data['recipes'])
+    chemical_index, chemical_names = compile_chemical_index(inorganic_data['chemicals'])
+
+    detection_digest = hashlib.sha256()
+    for name in DETECTION_FILES:
+        detection_digest.update(raw[name])
+    digest = detection_digest.copy()
+    for name in TREATMENT_FILES:
+        digest.update(raw[name])
+
+    snapshot = CatalogueSnapshot(
+        version=digest.hexdigest()[:16],
+        detection_version=detection_digest.hexdigest()[:16],
+        loaded_at=time.time(),
+        stamps=stamps,
+        disease_data=disease_data,
+        diseases_by_id=diseases_by_id,
+        scored_ids=tuple(scored_ids),
+        score_weights=score_weights,
+        score_bias=score_bias,
+        organic_data=organic_data,
+        inorganic_data=inorganic_data,
+        chemical_index=chemical_index,
+        chemical_names=chemical_names
+    )
+
+    # Static lookups are serialized once here rather than on every request;
+    # bodies come from the same methods that answer the dynamic endpoints
+    advisor = TreatmentAdvisor(catalogue=snapshot)
+    responses = {}
+    for disease_id, disease in diseases_by_id.items():
+        responses[('disease', disease_id)] = serialize_response(disease)
+    for disease_id in organic_data['recipes']:
+        responses[('organic', disease_id)] = serialize_response(advisor.get_organic_treatment(disease_id))
+    for disease_id, chemicals in inorganic_data['chemicals'].items():
+        if chemicals:
+            responses[('inorganic_options', disease_id)] = serialize_response(
+                advisor.get_inorganic_options(disease_id)
+            )
+    object.__setattr__(snapshot, 'responses', responses)
+    return snapshot
+
+class CatalogueWatcher:
+    """
+    Polls the catalogue files and, when one changes, loads and validates a
+    new snapshot on its own thread. Only a snapshot that loads cleanly
+    replaces the current one; a bad edit is recorded in last_error and the
+    previous catalogue keeps serving.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, interval=2.0):
+        """
+        Args:
+            data_dir: Directory holding the catalogue JSON files
+            interval: Seconds between checks once start() is called
+        """
+        self.data_dir = Path(data_dir)
+        self.interval = interval
+        self.current = load_catalogue(self.data_dir)
+        self.reloads = 0
+        self.last_error = None
+
+        self._listeners = []
+        self._failed_stamps = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, fn):
+        """Call fn(snapshot) after every successful reload"""
+        self._listeners.append(fn)
+
+    def start(self):
+        """Start checking for edits in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='catalogue-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def check(self):
+        """
+        Reload if any file changed since the current snapshot was loaded.
+        Nothing raised by a bad edit or a listener escapes: it is recorded in
+        last_error so the watcher thread keeps running and /api/catalogue reports it.
+        Returns: True if a new snapshot was swapped in
+        """
+        with self._lock:
+            stamps = None
+            try:
+                stamps = file_stamps(self.data_dir)
+                # Unchanged, or the same broken edit that already failed to load
+                if stamps == self.current.stamps or stamps == self._failed_stamps:
+                    return False
+                snapshot = load_catalogue(self.data_dir)
+            except Exception as e:
+                # Any shape of hand-edited JSON can surface as any exception type
+                self._failed_stamps = stamps
+                self.last_error = f'{type(e).__name__}: {e}'
+                return False
+
+            # A single reference assignment: readers see the old or the new snapshot, never a mix
+            self.current = snapshot
+            self.reloads += 1
+            self.last_error = None
+
+        for fn in self._listeners:
+            try:
+                fn(snapshot)
+            except Exception as e:
+                # e.g. a shared cache file that is locked; the other listeners still switch
+                self.last_error = f'{getattr(fn, "__name__", fn)} failed: {type(e).__name__}: {e}'
+        return True
+
+    def status(self):
+        snapshot = self.current
+        return {
+            'version': snapshot.version,
+            'loaded_at': snapshot.loaded_at,
+            'reloads': self.reloads,
+            'last_error': self.last_error
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
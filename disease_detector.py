@@ -1,134 +1,889 @@
+import base64
 import cv2
 import numpy as np
-import json
+import hashlib
+import math
+import threading
+from bisect import bisect_right
 from pathlib import Path
+from metrics import StageTimer
+
+# HSV ranges (inclusive, OpenCV hue scale 0-180) for the color bands we measure
+COLOR_BANDS = {
+    # Brown: Hue 10-20, moderate saturation
+    'brown': (np.array([5, 50, 50]), np.array([25, 255, 255])),
+    # Yellow: Hue 20-40
+    'yellow': (np.array([20, 50, 50]), np.array([40, 255, 255])),
+    # White (powdery): High value, low saturation
+    'white': (np.array([0, 0, 200]), np.array([180, 50, 255])),
+    # Dark spots: Low value
+    'dark': (np.array([0, 0, 0]), np.array([180, 255, 80])),
+    # Orange/rust color: Hue 5-15, high saturation
+    'rust': (np.array([5, 100, 100]), np.array([15, 255, 255])),
+}
+
+# Order of the feature vector used by the scoring matrix
+FEATURE_NAMES = [
+    'avg_hue', 'avg_saturation', 'avg_value',
+    'brown_percentage', 'yellow_percentage', 'white_percentage', 'dark_percentage', 'rust_percentage',
+    'edge_density', 'color_variance'
+]
+
+# Bump when feature extraction or scoring code changes so cached results are dropped
+# (edits to data/diseases.json or data/scoring_rules.json are picked up automatically)
+CLASSIFIER_VERSION = '2'
+
+def feature_settings(max_pixels=None, crop_leaf=False):
+    """
+    Detector settings that decide an image's feature vector; a KNNClassifier
+    records the ones its labelled vectors were extracted with
+    """
+    return {'classifier_version': CLASSIFIER_VERSION, 'max_pixels': max_pixels, 'crop_leaf': bool(crop_leaf)}
+
+# Upper bound on pixels held in memory at once by analyze_batch
+BATCH_MAX_PIXELS = 64 * 1024 * 1024
+
+# Images larger than this get throwaway buffers instead of growing the
+# per-thread workspace, so one huge upload does not pin memory for good.
+# A workspace takes 10 bytes per pixel; this fits a photo the browser has
+# shrunk to 1600 px on its longest side (app UPLOAD_MAX_DIMENSION) in
+# about 26 MB per thread.
+WORKSPACE_MAX_PIXELS = 1600 * 1600
+
+# Leaf segmentation runs on a proxy of at most this many pixels
+LEAF_PROXY_PIXELS = 256 * 256
+# Green (hue 25-95, OpenCV scale) with enough saturation and value to not be soil, sky or shadow
+LEAF_GREEN = (np.array([25, 40, 40]), np.array([95, 255, 255]))
+# Below this fraction of the proxy the leaf is not trusted and the full image is analyzed
+LEAF_MIN_FRACTION = 0.02
+# Margin added around the leaf's bounding box, as a fraction of its size
+LEAF_MARGIN = 0.05
+
+# Perceptual hashes are computed from a proxy of at most this many pixels
+PHASH_PROXY_PIXELS = 256 * 256
+
+# cv2.calcHist counts in float32, which is exact only up to 2**24 per bin
+HIST_CHUNK_PIXELS = 1 << 24
+
+def _build_band_tables():
+    """
+    Quantize each HSV channel at the COLOR_BANDS edges so that every band
+    becomes a box of bins. Summing the per-channel LUT outputs gives one
+    bin code per pixel, and a single histogram of those codes counts all
+    bands at once.
+    Returns: per-channel LUTs, bins per channel, band -> box of bin slices
+    """
+    edges = []
+    for channel in range(3):
+        cuts = set()
+        for lower, upper in COLOR_BANDS.values():
+            cuts.add(int(lower[channel]))
+            cuts.add(int(upper[channel]) + 1)
+        edges.append(sorted(c for c in cuts if 0 < c < 256))
+    
+    bins = tuple(len(e) + 1 for e in edges)
+    if bins[0] * bins[1] * bins[2] > 256:
+        raise ValueError('COLOR_BANDS need more than 256 combined bins')
+    strides = (bins[1] * bins[2], bins[2], 1)
+    
+    luts = tuple(
+        (np.searchsorted(edges[c], np.arange(256), side='right') * strides[c]).astype(np.uint8)
+        for c in range(3)
+    )
+    
+    boxes = {}
+    for band, (lower, upper) in COLOR_BANDS.items():
+        boxes[band] = tuple(
+            slice(bisect_right(edges[c], int(lower[c])), bisect_right(edges[c], min(int(upper[c]), 255)) + 1)
+            for c in range(3)
+        )
+    
+    return luts, bins, boxes
+
+BAND_LUTS, BAND_BINS, BAND_BOXES = _build_band_tables()
+
+def exact_histogram(img, n_bins):
+    """
+    Integer histogram of a uint8 image over values 0..n_bins-1. calcHist is
+    run in chunks so its float32 bin counts never pass 2**24 and stay exact.
+    """
+    flat = img.reshape(-1, 1)
+    hist = np.zeros(n_bins, dtype=np.int64)
+    for start in range(0, flat.shape[0], HIST_CHUNK_PIXELS):
+        chunk = flat[start:start + HIST_CHUNK_PIXELS]
+        hist += cv2.calcHist([chunk], [0], None, [n_bins], [0, n_bins]).ravel().astype(np.int64)
+    return hist
+
+class FeatureWorkspace:
+    """
+    Preallocated output buffers for feature extraction. Passed to
+    _extract_features, every OpenCV call writes into these arrays, so
+    frames or requests reuse the same memory. The backing storage only
+    grows: resizing to a smaller image reshapes views over it instead of
+    allocating.
+    """
+    
+    def __init__(self, height, width):
+        self._capacity = 0
+        self.resize(height, width)
+    
+    def resize(self, height, width):
+        """Point every buffer at a height x width view, growing storage if needed"""
+        pixels = height * width
+        if pixels > self._capacity:
+            self._hsv = np.empty(pixels * 3, dtype=np.uint8)
+            self._planes = np.empty((7, pixels), dtype=np.uint8)
+            self._capacity = pixels
+        
+        self.shape = (height, width)
+        self.hsv = self._hsv[:pixels * 3].reshape(height, width, 3)
+        planes = [self._planes[i, :pixels].reshape(height, width) for i in range(7)]
+        self.channels = planes[:3]
+        self.codes, self.scratch, self.gray, self.edges = planes[3:]
+        return self
+    
+    @property
+    def nbytes(self):
+        return self._hsv.nbytes + self._planes.nbytes
+
+def compile_scoring_rules(rules, disease_ids):
+    """
+    Compile per-disease linear scoring rules into a weight matrix
+    
+    Args:
+        rules: List of {'disease_id', 'bias', 'weights': {feature: weight}}
+        disease_ids: IDs present in the disease catalogue
+    
+    Returns: (scored disease ids, weights [diseases x features], bias [diseases])
+    """
+    if not isinstance(rules, list):
+        raise ValueError('Scoring rules must be a list')
+    scored_ids = []
+    weights = np.zeros((len(rules), len(FEATURE_NAMES)), dtype=np.float64)
+    bias = np.zeros(len(rules), dtype=np.float64)
+    
+    for row, rule in enumerate(rules):
+        if not isinstance(rule, dict) or not isinstance(rule.get('disease_id'), str):
+            raise ValueError(f"Scoring rule #{row} must be an object with a disease_id")
+        if rule['disease_id'] not in disease_ids:
+            raise ValueError(f"Scoring rule for unknown disease '{rule['disease_id']}'")
+        if not isinstance(rule.get('weights'), dict):
+            raise ValueError(f"Scoring rule for '{rule['disease_id']}' needs a weights object")
+        scored_ids.append(rule['disease_id'])
+        bias[row] = _rule_number(rule.get('bias', 0), 'bias', rule)
+        for name, weight in rule['weights'].items():
+            if name not in FEATURE_NAMES:
+                raise ValueError(f"Unknown feature '{name}' in scoring rule for '{rule['disease_id']}'")
+            weights[row, FEATURE_NAMES.index(name)] = _rule_number(weight, name, rule)
+    
+    return scored_ids, weights, bias
+
+def _rule_number(value, field, rule):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{field} in scoring rule for '{rule['disease_id']}' must be a number, got {value!r}")
+    return value
+
+def downsample_to(img, max_pixels):
+    """
+    Shrink img so it has at most max_pixels pixels. Area interpolation
+    averages source pixels, which keeps area percentages and means close
+    to their full-resolution values.
+    """
+    height, width = img.shape[:2]
+    if height * width <= max_pixels:
+        return img
+    
+    scale = (max_pixels / (height * width)) ** 0.5
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+def find_leaf_region(img):
+    """
+    Locate the leaf with a green/saturation threshold on a low-resolution
+    proxy. Closing bridges lesions and veins, and the largest outer contour
+    is filled so spots inside the leaf stay part of it.
+    
+    Returns: (x, y, width, height) box in img pixels and the proxy-sized
+             uint8 leaf mask, or (None, None) if no leaf-sized green area is found
+    """
+    height, width = img.shape[:2]
+    # Nearest-neighbour sampling reads only the proxy's pixels; the
+    # morphology below smooths out the aliasing
+    scale = min(1.0, (LEAF_PROXY_PIXELS / (height * width)) ** 0.5)
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    proxy = cv2.resize(img, size, interpolation=cv2.INTER_NEAREST)
+    
+    green = cv2.inRange(cv2.cvtColor(proxy, cv2.COLOR_BGR2HSV), *LEAF_GREEN)
+    size = max(3, min(proxy.shape[:2]) // 20) | 1
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+    green = cv2.morphologyEx(green, cv2.MORPH_CLOSE, kernel)
+    green = cv2.morphologyEx(green, cv2.MORPH_OPEN, kernel)
+    
+    contours, _ = cv2.findContours(green, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None, None
+    leaf = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(leaf) < LEAF_MIN_FRACTION * green.size:
+        return None, None
+    
+    mask = np.zeros_like(green)
+    cv2.drawContours(mask, [leaf], -1, 255, cv2.FILLED)
+    
+    # Scale the proxy box back to img pixels, with a margin for the leaf edge
+    px, py, pw, ph = cv2.boundingRect(leaf)
+    sx, sy = width / proxy.shape[1], height / proxy.shape[0]
+    mx, my = pw * LEAF_MARGIN, ph * LEAF_MARGIN
+    x0, y0 = max(0, int((px - mx) * sx)), max(0, int((py - my) * sy))
+    x1, y1 = min(width, int(np.ceil((px + pw + mx) * sx))), min(height, int(np.ceil((py + ph + my) * sy)))
+    return (x0, y0, x1 - x0, y1 - y0), mask
+
+def leaf_region_summary(img, box, mask):
+    """
+    Describe the analyzed region for the result: the crop box, the image it
+    was taken from, and the leaf mask as a PNG data URL for the UI
+    """
+    height, width = img.shape[:2]
+    if box is None:
+        return {'cropped': False, 'image_width': width, 'image_height': height}
+    
+    x, y, w, h = box
+    png = cv2.imencode('.png', mask)[1].tobytes()
+    return {
+        'cropped': True,
+        'image_width': width,
+        'image_height': height,
+        'x': x, 'y': y, 'width': w, 'height': h,
+        'analyzed_fraction': round(w * h / (width * height), 4),
+        'mask': 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+    }
+
+def perceptual_hash(img):
+    """
+    64-bit difference hash (dHash) of img: the sign of the brightness step
+    between neighbouring cells of a 9x8 grayscale thumbnail. Shots of the
+    same scene taken moments apart differ in only a few bits.
+    """
+    height, width = img.shape[:2]
+    # Sample a proxy first so the area average below touches few pixels
+    scale = min(1.0, (PHASH_PROXY_PIXELS / (height * width)) ** 0.5)
+    size = (max(9, int(width * scale)), max(8, int(height * scale)))
+    proxy = cv2.resize(img, size, interpolation=cv2.INTER_NEAREST)
+    
+    gray = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY)
+    thumb = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(thumb[:, 1:] > thumb[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+def source_perceptual_hash(source):
+    """
+    perceptual_hash of an image source without fully decoding it: encoded
+    bytes are decoded at a quarter of their size (JPEG decodes straight to
+    that scale), which is all the hash's proxy needs. Hashes from here and
+    from perceptual_hash of the full image differ slightly, so one index
+    should only be fed by one of them.
+    Returns: 64-bit hash, or None if the source cannot be decoded
+    """
+    if isinstance(source, np.ndarray) and source.ndim == 3:
+        return perceptual_hash(source) if source.size else None
+    try:
+        img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_4)
+    except (cv2.error, TypeError, ValueError):
+        return None
+    return perceptual_hash(img) if img is not None and img.size else None
+
+def content_key(source):
+    """
+    Hash image content for the result cache
+    Returns: (source, key); paths are read into bytes here so the file is
+             only read once. key is None if the source cannot be read.
+    """
+    if not isinstance(source, (bytes, bytearray, memoryview, np.ndarray)):
+        try:
+            with open(source, 'rb') as f:
+                source = f.read()
+        except (OSError, TypeError):
+            return source, None
+    
+    digest = hashlib.sha256()
+    if isinstance(source, np.ndarray):
+        # Decoded arrays hash their pixels together with their shape
+        digest.update(str(source.shape).encode())
+        digest.update(np.ascontiguousarray(source))
+    else:
+        digest.update(source)
+    return source, digest.hexdigest()
 
 class DiseaseDetector:
-    def __init__(self):
-        # Load disease database
-        with open('data/diseases.json', 'r') as f:
-            self.disease_data = json.load(f)
+    def __init__(self, fused_bands=True, cache=None, max_pixels=None, stage_recorder=None,
+                 reuse_buffers=False, crop_leaf=False, catalogue=None, near_duplicates=None,
+                 classifier=None):
+        """
+        Args:
+            fused_bands: Count all color bands from one histogram instead of one mask per band
+            cache: Optional ResultCache for detection results keyed by image content
+            max_pixels: If set, larger images are downsampled to at most this many
+                        pixels before feature extraction (see resolution_report.py)
+            stage_recorder: Optional callable(stage, seconds) receiving per-stage timings
+            reuse_buffers: Keep one FeatureWorkspace per thread and write every
+                           intermediate array of analyze_image into it
+            crop_leaf: Find the leaf on a low-resolution proxy and extract
+                       features from its bounding box only (see find_leaf_region)
+            catalogue: CatalogueSnapshot to start with (defaults to loading data/);
+                       swap later versions in with set_catalogue
+            near_duplicates: Optional NearDuplicateIndex; images whose perceptual
+                             hash is close to a recently analyzed one reuse its
+                             diagnosis, marked with 'reused': True
+            classifier: Optional KNNClassifier (see knn_classifier.py) that diagnoses
+                        by a vote of labelled examples instead of the scoring rules;
+                        it must have been built from features extracted with this
+                        detector's max_pixels and crop_leaf
+        
+        Raises: ValueError if the classifier's feature settings differ from the detector's
+        """
+        if classifier is not None:
+            expected = feature_settings(max_pixels, crop_leaf)
+            if classifier.settings != expected:
+                raise ValueError(
+                    f'Classifier was built from features extracted with {classifier.settings}, '
+                    f'but this detector extracts them with {expected}; rescan the labelled '
+                    f'images with matching settings and rebuild the model'
+                )
+        
+        self.fused_bands = fused_bands
+        self.max_pixels = max_pixels
+        self.timer = StageTimer(stage_recorder)
+        self.reuse_buffers = reuse_buffers
+        self.crop_leaf = crop_leaf
+        self._local = threading.local()
+        self.cache = cache
+        self.near_duplicates = near_duplicates
+        self.classifier = classifier
+        
+        if catalogue is None:
+            from catalogue import load_catalogue
+            catalogue = load_catalogue()
+        self.set_catalogue(catalogue)
+    
+    def set_catalogue(self, catalogue):
+        """
+        Switch to another CatalogueSnapshot (disease data and scoring rules).
+        Analyses already running finish on the snapshot they started with.
+        """
+        # Results depend on the catalogue, the classifier rules and the analyzed pixels
+        rules = f'{CLASSIFIER_VERSION}:{self.max_pixels}:{self.crop_leaf}:{catalogue.detection_version}'
+        if self.classifier is not None:
+            rules += f':knn:{self.classifier.version}'
+        rules_version = hashlib.sha256(rules.encode()).hexdigest()[:16]
+        # Published as one reference so no reader pairs a catalogue with another one's version
+        self._published = (catalogue, rules_version)
+        
+        if self.cache is not None:
+            self.cache.set_version(rules_version)
+        if self.near_duplicates is not None:
+            self.near_duplicates.set_version(rules_version)
+    
+    @property
+    def catalogue(self):
+        """Current CatalogueSnapshot"""
+        return self._published[0]
+    
+    @property
+    def rules_version(self):
+        """Version tag of results computed under the current catalogue and settings"""
+        return self._published[1]
     
-    def analyze_image(self, image_path):
+    def analyze_image(self, image):
         """
         Analyze plant image using OpenCV to detect disease
-        Returns: disease_id, severity, confidence
+        
+        Args:
+            image: Image path, encoded image bytes / 1-D uint8 buffer, or BGR array
+        
+        Returns: Detection result dict, or None if the image cannot be read
         """
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
-            return None, None, 0
+        # Reuse the result of an identical earlier image
+        key = None
+        if self.cache is not None:
+            image, key = content_key(image)
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                return cached
         
-        # Convert to different color spaces for analysis
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+        timer = self.timer
+        catalogue, version = self._published
+        
+        # Read or decode image
+        with timer.stage('decode'):
+            img = self._load_image(image)
+        if img is None:
+            return None
+        with timer.stage('resize'):
+            img = self._limit_resolution(img)
+        phash, disease_result = self._find_near_duplicate(img)
         
-        # Extract features
-        features = self._extract_features(img, hsv, lab)
+        if disease_result is None:
+            img, region = self._crop_to_leaf(img)
+            # Only HSV is needed up front; gray is converted inside _extract_features
+            workspace = self._workspace(img)
+            with timer.stage('cvt_hsv'):
+                hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=workspace.hsv if workspace else None)
+            
+            # Extract features
+            features = self._extract_features(img, hsv, None, workspace)
+            
+            # Detect disease based on features
+            with timer.stage('classify'):
+                disease_result = self._classify_disease(features, catalogue)
+            if region is not None:
+                disease_result['leaf_region'] = region
+            if phash is not None:
+                self.near_duplicates.put(phash, disease_result, version)
         
-        # Detect disease based on features
-        disease_result = self._classify_disease(features)
+        if key is not None:
+            self.cache.put(key, disease_result, version)
         
         return disease_result
     
-    def _extract_features(self, img, hsv, lab):
-        """Extract color and texture features from image"""
+    def analyze_batch(self, images):
+        """
+        Analyze many plant images together
+        
+        Args:
+            images: Iterable of image sources (see analyze_image); read lazily
+        
+        Returns: List with one detection result per input, in input order.
+                 Inputs that cannot be read get {'error': ...} instead.
+        """
+        results = []
+        chunk = []
+        chunk_pixels = 0
+        
+        for source in images:
+            results.append(None)
+            
+            key = None
+            if self.cache is not None:
+                source, key = content_key(source)
+                cached = self.cache.get(key) if key else None
+                if cached is not None:
+                    results[-1] = cached
+                    continue
+            
+            with self.timer.stage('decode'):
+                img = self._load_image(source)
+            if img is None:
+                results[-1] = {'error': 'Failed to read image'}
+                continue
+            with self.timer.stage('resize'):
+                img = self._limit_resolution(img)
+            version = self.rules_version
+            phash, detection = self._find_near_duplicate(img)
+            img, region = self._crop_to_leaf(img)
+            
+            if detection is not None:
+                if region is not None:
+                    detection['leaf_region'] = region
+                results[-1] = detection
+                if key is not None:
+                    self.cache.put(key, detection, version)
+                continue
+            
+            chunk.append((len(results) - 1, img, key, region, phash))
+            chunk_pixels += img.shape[0] * img.shape[1]
+            
+            # Flush in bounded chunks so a large batch never sits in memory at once
+            if chunk_pixels >= BATCH_MAX_PIXELS:
+                self._analyze_chunk(chunk, results)
+                chunk = []
+                chunk_pixels = 0
+        
+        if chunk:
+            self._analyze_chunk(chunk, results)
+        
+        return results
+    
+    def analyze_video(self, source, sample_fps=2.0, segment_seconds=10.0, diff_threshold=3.0):
+        """
+        Analyze a video file or camera stream, yielding one diagnosis per segment
+        
+        Args:
+            source: Video file path, or camera index for a live stream
+            sample_fps: At most this many frames per second are analyzed;
+                        the rest are grabbed without being converted
+            segment_seconds: Length of each reported segment
+            diff_threshold: Sampled frames whose 64x36 thumbnail differs from the
+                            last analyzed frame by less than this mean absolute
+                            difference (0-255) are skipped as near-identical;
+                            they count as repeats of that frame
+        
+        Yields: Detection result for each segment with sampled frames (features
+                averaged over them, skipped frames carrying the last analyzed
+                frame's features and vote) with segment timing, frame counts
+                and per-frame votes
+        """
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f'Could not open video source {source!r}')
+        
+        # Cameras often report 0 fps
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        step = max(1, round(fps / sample_fps))
+        
+        frame = None
+        workspace = None
+        thumb = np.empty((36, 64, 3), dtype=np.uint8)
+        last_thumb = np.empty_like(thumb)
+        have_last = False
+        last_features = last_disease = None
+        segment = self._new_segment(0, 0.0, segment_seconds)
+        frame_index = -1
+        
+        try:
+            while capture.grab():
+                frame_index += 1
+                timestamp = frame_index / fps
+                
+                if timestamp >= segment['end_s']:
+                    if segment['frames_analyzed'] or segment['frames_skipped']:
+                        yield self._segment_result(segment)
+                    segment = self._new_segment(segment['segment'] + 1, segment['end_s'], segment_seconds)
+                
+                # Frames between samples are decoded by grab() but never converted
+                if frame_index % step:
+                    continue
+                
+                ok, frame = capture.retrieve(frame)
+                if not ok:
+                    continue
+                
+                # Skip frames that barely changed since the last analyzed one
+                cv2.resize(frame, (64, 36), dst=thumb, interpolation=cv2.INTER_AREA)
+                if have_last and cv2.norm(thumb, last_thumb, cv2.NORM_L1) / thumb.size < diff_threshold:
+                    # A repeat of the last analyzed frame, which may be in an earlier
+                    # segment: a still scene must not leave a segment undiagnosed
+                    segment['frames_skipped'] += 1
+                    self._add_frame(segment, last_features, last_disease)
+                    continue
+                thumb, last_thumb = last_thumb, thumb
+                have_last = True
+                
+                img, _ = self._crop_to_leaf(self._limit_resolution(frame))
+                if workspace is None:
+                    workspace = FeatureWorkspace(*img.shape[:2])
+                else:
+                    workspace.resize(*img.shape[:2])
+                
+                hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=workspace.hsv)
+                features = self._extract_features(img, hsv, None, workspace)
+                detection = self._classify_disease(features)
+                
+                segment['frames_analyzed'] += 1
+                last_features, last_disease = features, detection['disease_id']
+                self._add_frame(segment, last_features, last_disease)
+            
+            if segment['frames_analyzed'] or segment['frames_skipped']:
+                yield self._segment_result(segment, end_s=(frame_index + 1) / fps)
+        finally:
+            capture.release()
+    
+    def _new_segment(self, index, start_s, length_s):
+        return {
+            'segment': index,
+            'start_s': start_s,
+            'end_s': start_s + length_s,
+            'frames_analyzed': 0,
+            'frames_skipped': 0,
+            'votes': {},
+            'feature_sums': dict.fromkeys(FEATURE_NAMES, 0.0)
+        }
+    
+    def _add_frame(self, segment, features, disease_id):
+        """Count one sampled frame's vote and features towards its segment"""
+        segment['votes'][disease_id] = segment['votes'].get(disease_id, 0) + 1
+        for name in FEATURE_NAMES:
+            segment['feature_sums'][name] += features[name]
+    
+    def _segment_result(self, segment, end_s=None):
+        """Classify a segment from the mean features of its sampled frames"""
+        n = segment['frames_analyzed'] + segment['frames_skipped']
+        features = {name: total / n for name, total in segment['feature_sums'].items()}
+        result = self._classify_disease(features)
+        result.update({
+            'segment': segment['segment'],
+            'start_s': round(segment['start_s'], 3),
+            'end_s': round(end_s if end_s is not None else segment['end_s'], 3),
+            'frames_analyzed': segment['frames_analyzed'],
+            'frames_skipped': segment['frames_skipped'],
+            'votes': segment['votes']
+        })
+        return result
+    
+    def _find_near_duplicate(self, img):
+        """
+        Look img up in the near-duplicate index
+        Returns: (perceptual hash, reused detection result or None); the hash
+                 is None when no index is configured
+        """
+        if self.near_duplicates is None:
+            return None, None
+        
+        with self.timer.stage('near_duplicate'):
+            phash = perceptual_hash(img)
+            match = self.near_duplicates.get(phash)
+        if match is None:
+            return phash, None
+        
+        # As in InferencePool, the reused result keeps the earlier shot's leaf_region
+        result, distance = match
+        result['reused'] = True
+        result['reuse_distance'] = distance
+        return phash, result
+    
+    def _crop_to_leaf(self, img):
+        """
+        Crop img to the leaf when crop_leaf is on
+        Returns: (image to analyze, leaf_region summary or None when cropping is off)
+        """
+        if not self.crop_leaf:
+            return img, None
+        
+        with self.timer.stage('leaf_roi'):
+            box, mask = find_leaf_region(img)
+            region = leaf_region_summary(img, box, mask)
+            if box is not None:
+                x, y, w, h = box
+                img = img[y:y + h, x:x + w]
+        return img, region
+    
+    def _workspace(self, img):
+        """
+        This thread's FeatureWorkspace resized to img, or None when buffer
+        reuse is off or img is too large to keep buffers for
+        """
+        height, width = img.shape[:2]
+        if not self.reuse_buffers or height * width > WORKSPACE_MAX_PIXELS:
+            return None
+        
+        workspace = getattr(self._local, 'workspace', None)
+        if workspace is None:
+            workspace = self._local.workspace = FeatureWorkspace(height, width)
+            return workspace
+        return workspace.resize(height, width)
+    
+    def _load_image(self, source):
+        """
+        Read an image path, decode encoded bytes, or validate a BGR array
+        Returns: BGR image, or None if the source is unusable
+        """
+        try:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+            elif isinstance(source, np.ndarray) and source.ndim == 1:
+                # Encoded file contents already in memory
+                img = cv2.imdecode(source, cv2.IMREAD_COLOR)
+            elif isinstance(source, np.ndarray):
+                img = source
+            else:
+                img = cv2.imread(str(source))
+        except cv2.error:
+            return None
+        
+        if img is None or img.dtype != np.uint8 or img.ndim != 3 or img.shape[2] != 3 or img.size == 0:
+            return None
+        return img
+    
+    def _limit_resolution(self, img):
+        """Downsample img to at most max_pixels pixels, keeping its aspect ratio"""
+        if self.max_pixels is None:
+            return img
+        return downsample_to(img, self.max_pixels)
+    
+    def _analyze_chunk(self, chunk, results):
+        """Run feature extraction and scoring for one chunk of analyze_batch"""
+        catalogue, version = self._published
+        with self.timer.stage('batch_features'):
+            features = self._extract_features_batch([img for _, img, _, _, _ in chunk])
+        with self.timer.stage('batch_classify'):
+            detections = self._classify_batch(features, catalogue)
+        for (index, _, key, region, phash), detection in zip(chunk, detections):
+            if phash is not None:
+                self.near_duplicates.put(phash, detection, version)
+            if region is not None:
+                detection['leaf_region'] = region
+            results[index] = detection
+            if key is not None:
+                self.cache.put(key, detection, version)
+    
+    def _extract_features_batch(self, images):
+        """
+        Extract features for several images at once
+        Returns: feature name -> NumPy array with one value per image
+        """
+        sizes = np.array([img.shape[0] * img.shape[1] for img in images])
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        
+        # Color conversion is per pixel, so every image is stacked into one
+        # N x 1 strip and converted with a single call
+        pixels = np.concatenate([img.reshape(-1, 1, 3) for img in images])
+        hsv = cv2.cvtColor(pixels, cv2.COLOR_BGR2HSV)
+        gray = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+        
         features = {}
         
-        # Color analysis in HSV
-        h, s, v = cv2.split(hsv)
-        features['avg_hue'] = np.mean(h)
-        features['avg_saturation'] = np.mean(s)
-        features['avg_value'] = np.mean(v)
+        # Per-image channel means from segmented sums
+        channel_sums = np.add.reduceat(hsv.reshape(-1, 3), offsets, axis=0, dtype=np.int64)
+        features['avg_hue'] = channel_sums[:, 0] / sizes
+        features['avg_saturation'] = channel_sums[:, 1] / sizes
+        features['avg_value'] = channel_sums[:, 2] / sizes
         
-        # Detect brown/yellow spots (common in diseases)
-        # Brown: Hue 10-20, moderate saturation
-        brown_mask = cv2.inRange(hsv, np.array([5, 50, 50]), np.array([25, 255, 255]))
-        features['brown_percentage'] = (np.sum(brown_mask > 0) / brown_mask.size) * 100
+        # Band counts for the whole batch, taken per image
+        if self.fused_bands:
+            codes = self._band_codes(*cv2.split(hsv))
+            counts = [self._band_counts(codes[start:start + size]) for start, size in zip(offsets, sizes)]
+            for band in COLOR_BANDS:
+                features[f'{band}_percentage'] = (np.array([c[band] for c in counts]) / sizes) * 100
+        else:
+            for band, (lower, upper) in COLOR_BANDS.items():
+                mask = cv2.inRange(hsv, lower, upper)
+                counts = np.add.reduceat(mask.ravel() > 0, offsets, dtype=np.int64)
+                features[f'{band}_percentage'] = (counts / sizes) * 100
         
-        # Yellow: Hue 20-40
-        yellow_mask = cv2.inRange(hsv, np.array([20, 50, 50]), np.array([40, 255, 255]))
-        features['yellow_percentage'] = (np.sum(yellow_mask > 0) / yellow_mask.size) * 100
+        # Edges and variance are spatial/global, so they stay per image
+        edge_density = []
+        color_variance = []
+        for img, start, size in zip(images, offsets, sizes):
+            img_gray = gray[start:start + size].reshape(img.shape[:2])
+            edges = cv2.Canny(img_gray, 50, 150)
+            edge_density.append((np.sum(edges > 0) / edges.size) * 100)
+            color_variance.append(np.var(img_gray))
+        features['edge_density'] = np.array(edge_density)
+        features['color_variance'] = np.array(color_variance)
         
-        # White (powdery): High value, low saturation
-        white_mask = cv2.inRange(hsv, np.array([0, 0, 200]), np.array([180, 50, 255]))
-        features['white_percentage'] = (np.sum(white_mask > 0) / white_mask.size) * 100
+        return features
+    
+    def _extract_features(self, img, hsv, lab, workspace=None):
+        """
+        Extract color and texture features from image
         
-        # Dark spots: Low value
-        dark_mask = cv2.inRange(hsv, np.array([0, 0, 0]), np.array([180, 255, 80]))
-        features['dark_percentage'] = (np.sum(dark_mask > 0) / dark_mask.size) * 100
+        With a FeatureWorkspace sized to img, every intermediate array is
+        written into the workspace instead of being allocated; the variance
+        then comes from a gray-level histogram (equal to np.var up to float
+        rounding) rather than a float64 copy of the image.
+        """
+        timer = self.timer
+        ws = workspace
+        features = {}
         
-        # Orange/rust color: Hue 5-15, high saturation
-        rust_mask = cv2.inRange(hsv, np.array([5, 100, 100]), np.array([15, 255, 255]))
-        features['rust_percentage'] = (np.sum(rust_mask > 0) / rust_mask.size) * 100
+        # Color analysis in HSV
+        with timer.stage('hsv_means'):
+            h, s, v = cv2.split(hsv, ws.channels if ws else None)
+            features['avg_hue'] = np.mean(h)
+            features['avg_saturation'] = np.mean(s)
+            features['avg_value'] = np.mean(v)
+        
+        # Detect brown/yellow/white/dark/rust spots (common in diseases)
+        if self.fused_bands:
+            with timer.stage('bands_fused'):
+                for band, count in self._band_counts(self._band_codes(h, s, v, ws)).items():
+                    features[f'{band}_percentage'] = (count / h.size) * 100
+        else:
+            for band, (lower, upper) in COLOR_BANDS.items():
+                with timer.stage(f'mask_{band}'):
+                    mask = cv2.inRange(hsv, lower, upper, dst=ws.scratch if ws else None)
+                    count = cv2.countNonZero(mask) if ws else np.sum(mask > 0)
+                    features[f'{band}_percentage'] = (count / mask.size) * 100
         
         # Texture analysis using edge detection
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
-        features['edge_density'] = (np.sum(edges > 0) / edges.size) * 100
+        with timer.stage('cvt_gray'):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=ws.gray if ws else None)
+        with timer.stage('canny'):
+            edges = cv2.Canny(gray, 50, 150, edges=ws.edges if ws else None)
+            count = cv2.countNonZero(edges) if ws else np.sum(edges > 0)
+            features['edge_density'] = (count / edges.size) * 100
         
         # Calculate variance (indicates mottled patterns)
-        features['color_variance'] = np.var(gray)
+        with timer.stage('variance'):
+            if ws:
+                hist = exact_histogram(gray, 256).astype(np.float64)
+                levels = np.arange(256, dtype=np.float64)
+                mean = (hist @ levels) / gray.size
+                features['color_variance'] = (hist @ (levels - mean) ** 2) / gray.size
+            else:
+                features['color_variance'] = np.var(gray)
         
         return features
     
-    def _classify_disease(self, features):
+    def _band_codes(self, h, s, v, workspace=None):
+        """Map every pixel to its combined HSV bin code (see _build_band_tables)"""
+        if workspace is None:
+            return cv2.add(cv2.add(cv2.LUT(h, BAND_LUTS[0]), cv2.LUT(s, BAND_LUTS[1])), cv2.LUT(v, BAND_LUTS[2]))
+        
+        codes, scratch = workspace.codes, workspace.scratch
+        cv2.LUT(h, BAND_LUTS[0], dst=codes)
+        cv2.add(codes, cv2.LUT(s, BAND_LUTS[1], dst=scratch), dst=codes)
+        cv2.add(codes, cv2.LUT(v, BAND_LUTS[2], dst=scratch), dst=codes)
+        return codes
+    
+    def _band_counts(self, codes):
+        """Count pixels in every color band from one histogram of bin codes"""
+        hist = exact_histogram(codes, BAND_BINS[0] * BAND_BINS[1] * BAND_BINS[2]).reshape(BAND_BINS)
+        return {band: int(hist[box].sum()) for band, box in BAND_BOXES.items()}
+    
+    def _classify_disease(self, features, catalogue=None):
         """
         Classify disease based on extracted features
         Returns: (disease_id, severity, confidence)
         """
-        # Rule-based classification
-        disease_scores = {}
-        
-        # Leaf Blight: High brown percentage, moderate edge density
-        disease_scores['leaf_blight'] = (
-            features['brown_percentage'] * 0.4 +
-            features['yellow_percentage'] * 0.2 +
-            features['edge_density'] * 0.3 +
-            (features['dark_percentage'] * 0.1)
-        )
+        catalogue = catalogue or self.catalogue
+        x = np.array([features[name] for name in FEATURE_NAMES], dtype=np.float64)
+        if self.classifier is not None:
+            return self._neighbour_result(self.classifier.predict(x[None])[0], features, catalogue)
+        if not catalogue.scored_ids:
+            return None, None, 0
         
-        # Powdery Mildew: High white percentage, low edge density
-        disease_scores['powdery_mildew'] = (
-            features['white_percentage'] * 0.6 +
-            (100 - features['edge_density']) * 0.2 +
-            features['yellow_percentage'] * 0.2
-        )
+        # One matrix-vector product scores every disease
+        scores = catalogue.score_weights @ x + catalogue.score_bias
         
-        # Bacterial Spot: High dark percentage, high edge density
-        disease_scores['bacterial_spot'] = (
-            features['dark_percentage'] * 0.5 +
-            features['edge_density'] * 0.3 +
-            features['brown_percentage'] * 0.2
-        )
-        
-        # Rust: High rust/orange percentage
-        disease_scores['rust'] = (
-            features['rust_percentage'] * 0.6 +
-            features['brown_percentage'] * 0.2 +
-            features['yellow_percentage'] * 0.2
-        )
-        
-        # Mosaic Virus: High color variance (mottled pattern)
-        disease_scores['mosaic_virus'] = (
-            (features['color_variance'] / 100) * 0.5 +
-            features['yellow_percentage'] * 0.3 +
-            features['edge_density'] * 0.2
-        )
+        # argmax keeps the first maximum, same tie-break as the catalogue order
+        best = int(np.argmax(scores))
+        return self._build_result(catalogue.scored_ids[best], scores[best], features, catalogue)
+    
+    def _classify_batch(self, features, catalogue=None):
+        """
+        Classify a batch of images from column-wise features
+        (feature name -> array with one value per image)
+        """
+        catalogue = catalogue or self.catalogue
+        x = np.column_stack([features[name] for name in FEATURE_NAMES]).astype(np.float64)
+        image_features = [{name: float(values[row]) for name, values in features.items()} for row in range(len(x))]
         
-        # Anthracnose: Dark sunken spots
-        disease_scores['anthracnose'] = (
-            features['dark_percentage'] * 0.4 +
-            features['brown_percentage'] * 0.3 +
-            features['edge_density'] * 0.3
-        )
+        if self.classifier is not None:
+            # One tree search answers the whole batch
+            predictions = self.classifier.predict(x)
+            return [self._neighbour_result(prediction, image_features[row], catalogue)
+                    for row, prediction in enumerate(predictions)]
         
-        # Find disease with highest score
-        if not disease_scores:
-            return None, None, 0
+        # One matrix-matrix product scores every image against every disease
+        scores = x @ catalogue.score_weights.T + catalogue.score_bias
+        best = np.argmax(scores, axis=1)
         
-        detected_disease = max(disease_scores, key=disease_scores.get)
-        confidence = min(disease_scores[detected_disease], 100)
+        results = []
+        for row, col in enumerate(best):
+            results.append(self._build_result(
+                catalogue.scored_ids[col], float(scores[row, col]), image_features[row], catalogue
+            ))
+        return results
+    
+    def _neighbour_result(self, prediction, features, catalogue):
+        """Detection result for a KNNClassifier prediction; confidence is the winner's vote share"""
+        disease_id, vote_share, votes = prediction
+        result = self._build_result(disease_id, vote_share, features, catalogue)
+        result['neighbour_votes'] = votes
+        return result
+    
+    def _build_result(self, detected_disease, score, features, catalogue):
+        """Assemble the detection result for the winning disease score"""
+        confidence = min(score, 100)
         
         # Determine severity based on affected area
         total_affected = (features['brown_percentage'] + features['yellow_percentage'] + 
@@ -142,10 +897,7 @@ class DiseaseDetector:
             severity = 'severe'
         
         # Get disease details
-        disease_info = next(
-            (d for d in self.disease_data['diseases'] if d['id'] == detected_disease),
-            None
-        )
+        disease_info = catalogue.diseases_by_id.get(detected_disease)
         
         return {
             'disease_id': detected_disease,
@@ -158,8 +910,10 @@ class DiseaseDetector:
     
     def get_disease_info(self, disease_id):
         """Get detailed information about a specific disease"""
-        disease = next(
-            (d for d in self.disease_data['diseases'] if d['id'] == disease_id),
-            None
-        )
-        return disease
+        return self.catalogue.diseases_by_id.get(disease_id)
+
+if __name__ == '__main__':
+    # python -m disease_detector scan <dir> (see bulk_scan.py)
+    import sys
+    from bulk_scan import main
+    sys.exit(main())
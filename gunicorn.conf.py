@@ -0,0 +1,51 @@
+"""
+Production server settings, read by gunicorn from the working directory:
+
+    gunicorn app:app
+
+The app is imported once in the master process (preload_app), so the
+catalogues, compiled scoring matrix, OpenCV and NumPy are loaded a single
+time and shared copy-on-write by every forked worker. Each worker then runs
+a warm-up analysis before it accepts connections; /readyz reports ready
+only after that.
+
+Environment:
+    PORT          Listen port (default 5000)
+    WEB_WORKERS   Worker processes (default: CPU count)
+    WEB_THREADS   Request threads per worker (default 4)
+    JOB_STORE_DB  SQLite file the workers share diagnosis jobs through
+                  (default jobs.sqlite3 in the working directory)
+"""
+
+import gc
+import os
+
+# Every worker analyzes in-process; gunicorn's workers already use all CPUs,
+# and a process pool per worker would oversubscribe them. Each worker still
+# bounds its concurrent analyses (INFERENCE_MAX_PENDING) and answers 503 past that.
+os.environ.setdefault('INFERENCE_WORKERS', '0')
+# A job is created in whichever worker took the POST, but its polls and
+# event streams can land on any worker, so they must share one job store
+os.environ.setdefault('JOB_STORE_DB', 'jobs.sqlite3')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+# Threads keep long-lived requests (SSE job events) from blocking a whole worker
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 60
+preload_app = True
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers do not touch (and copy) the shared pages
+    gc.freeze()
+
+def post_worker_init(worker):
+    from app import warm_up, readiness
+
+    warm_up()
+    if readiness['ready']:
+        worker.log.info('Worker %s warmed up in %.3fs', worker.pid, readiness['warm_up_seconds'])
+    else:
+        worker.log.error('Worker %s warm-up failed: %s', worker.pid, readiness['error'])
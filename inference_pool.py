@@ -0,0 +1,342 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from disease_detector import DiseaseDetector, content_key, source_perceptual_hash
+from metrics import StageTimer
+
+# Upper bound on image input (encoded bytes or arrays) held at once by analyze_batch
+BATCH_MAX_BYTES = 64 * 1024 * 1024
+# Catalogue snapshot files kept, so jobs queued just before a reload can still load theirs
+CATALOGUE_FILES_KEPT = 4
+
+class PoolBusyError(Exception):
+    """Raised when the submission queue is full; clients should retry later"""
+
+class JobTimeoutError(Exception):
+    """Raised when an analysis job does not finish within the pool timeout"""
+
+# Each worker process builds its own detector once, on its first job
+_worker_detector = None
+_worker_options = None
+# Stage timings collected in the worker, shipped back with each result
+_worker_stages = None
+
+def _source_size(image):
+    """Bytes an image source holds in memory (paths count as nothing until read)"""
+    if isinstance(image, np.ndarray):
+        return image.nbytes
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return len(image)
+    return 0
+
+def _init_worker(detector_options, collect_stages):
+    global _worker_options, _worker_stages
+    _worker_options = dict(detector_options)
+    if collect_stages:
+        _worker_stages = []
+        _worker_options['stage_recorder'] = lambda stage, seconds: _worker_stages.append((stage, seconds))
+
+def _use_catalogue(catalogue):
+    # Workers never read data/ themselves: every job carries the version of
+    # the parent's validated snapshot and the path of its pickled copy, read
+    # only when the version differs from the one this worker already has
+    global _worker_detector
+    if _worker_detector is not None and (catalogue is None or _worker_detector.catalogue.version == catalogue[0]):
+        return
+    
+    snapshot = None
+    if catalogue is not None:
+        with open(catalogue[1], 'rb') as f:
+            snapshot = pickle.load(f)
+    if _worker_detector is None:
+        _worker_detector = DiseaseDetector(catalogue=snapshot, **_worker_options)
+    else:
+        _worker_detector.set_catalogue(snapshot)
+
+def _with_stages(result):
+    version = _worker_detector.rules_version
+    if _worker_stages is None:
+        return result, None, version
+    stages = list(_worker_stages)
+    _worker_stages.clear()
+    return result, stages, version
+
+def _analyze_image(image, catalogue):
+    _use_catalogue(catalogue)
+    return _with_stages(_worker_detector.analyze_image(image))
+
+def _warm_up(image, catalogue):
+    _use_catalogue(catalogue)
+    _worker_detector.analyze_image(image)
+    return os.getpid()
+
+def _analyze_batch(images, catalogue):
+    _use_catalogue(catalogue)
+    return _with_stages(_worker_detector.analyze_batch(images))
+
+class LocalAnalyzer:
+    """
+    Runs DiseaseDetector analysis on the calling thread, for servers whose
+    own worker processes already use every CPU. Admission is bounded like
+    InferencePool's: once max_pending analyses are running, new ones fail
+    fast with PoolBusyError instead of piling up.
+    """
+
+    def __init__(self, detector, max_pending=None):
+        """
+        Args:
+            detector: DiseaseDetector shared by the request threads
+            max_pending: Analyses allowed at once before rejecting (defaults to 4)
+        """
+        self.detector = detector
+        self.max_pending = max_pending or 4
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def analyze_image(self, image):
+        """Same contract as DiseaseDetector.analyze_image"""
+        with self._slot():
+            return self.detector.analyze_image(image)
+
+    def analyze_batch(self, images):
+        """Same contract as DiseaseDetector.analyze_batch; the batch holds one slot"""
+        with self._slot():
+            return self.detector.analyze_batch(images)
+
+    @contextmanager
+    def _slot(self):
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusyError('Analysis queue is full')
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+class InferencePool:
+    """
+    Runs DiseaseDetector analysis in a pool of worker processes so CPU-bound
+    OpenCV work does not stall request threads. Submissions are bounded:
+    once max_pending jobs are queued or running, new ones fail fast with
+    PoolBusyError instead of piling up.
+    """
+
+    def __init__(self, workers=None, max_pending=None, timeout=30, cache=None, detector_options=None,
+                 stage_recorder=None, near_duplicates=None):
+        """
+        Args:
+            workers: Number of worker processes (defaults to the CPU count)
+            max_pending: Jobs allowed in flight before rejecting (defaults to 4 per worker)
+            timeout: Seconds to wait for one job
+            cache: Optional ResultCache checked in this process before submitting
+            detector_options: Keyword arguments for each worker's DiseaseDetector
+            stage_recorder: Optional callable(stage, seconds) fed with worker stage timings
+            near_duplicates: Optional NearDuplicateIndex checked in this process
+                             before submitting, so every worker's results are
+                             reused; like cache, its version is kept current by
+                             the caller
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.timeout = timeout
+        self.cache = cache
+        self.near_duplicates = near_duplicates
+        self.timer = StageTimer(stage_recorder)
+        self.detector_options = detector_options or {}
+        self.stage_recorder = stage_recorder
+        self.catalogue_version = None
+        # (version, path of the pickled CatalogueSnapshot) sent along with every job
+        self._catalogue = None
+        self._catalogue_dir = None
+        self._catalogue_files = deque()
+
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def analyze_image(self, image):
+        """Same contract as DiseaseDetector.analyze_image, run in a worker"""
+        key = None
+        if self.cache is not None:
+            image, key = content_key(image)
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                return cached
+
+        phash, reused = self._find_near_duplicate(image)
+        if reused is not None:
+            if key is not None:
+                self.cache.put(key, reused, self.near_duplicates.version)
+            return reused
+
+        result, version = self._result(self._submit(_analyze_image, image, self._catalogue))
+
+        if result is not None:
+            self._remember(key, phash, result, version)
+        return result
+
+    def analyze_batch(self, images):
+        """
+        Same contract as DiseaseDetector.analyze_batch. Images are read
+        lazily, a chunk of up to BATCH_MAX_BYTES at a time; each chunk is
+        split into one sub-batch per worker (one queued job each) and
+        finished before the next chunk is read.
+        """
+        results = []
+        pending = []
+        pending_bytes = 0
+
+        for image in images:
+            results.append(None)
+            index = len(results) - 1
+            key = None
+            if self.cache is not None:
+                image, key = content_key(image)
+                cached = self.cache.get(key) if key else None
+                if cached is not None:
+                    results[index] = cached
+                    continue
+            phash, reused = self._find_near_duplicate(image)
+            if reused is not None:
+                results[index] = reused
+                if key is not None:
+                    self.cache.put(key, reused, self.near_duplicates.version)
+                continue
+            pending.append((index, image, key, phash))
+            pending_bytes += _source_size(image)
+
+            if pending_bytes >= BATCH_MAX_BYTES:
+                self._analyze_chunk(pending, results)
+                pending = []
+                pending_bytes = 0
+
+        if pending:
+            self._analyze_chunk(pending, results)
+        return results
+
+    def _analyze_chunk(self, pending, results):
+        """Analyze one chunk of analyze_batch across the workers, filling in results"""
+        size = -(-len(pending) // self.workers)
+        jobs = []
+        try:
+            for start in range(0, len(pending), size):
+                part = pending[start:start + size]
+                jobs.append((part, self._submit(
+                    _analyze_batch, [image for _, image, _, _ in part], self._catalogue
+                )))
+        except PoolBusyError:
+            for _, job in jobs:
+                job.cancel()
+            raise
+
+        for part, job in jobs:
+            detections, version = self._result(job)
+            for (index, _, key, phash), detection in zip(part, detections):
+                results[index] = detection
+                if 'error' not in detection:
+                    self._remember(key, phash, detection, version)
+
+    def set_catalogue(self, catalogue):
+        """Have workers switch to this CatalogueSnapshot before their next job"""
+        # Pickled once to a file that each worker reads once per version,
+        # rather than shipped with every job
+        if self._catalogue_dir is None:
+            self._catalogue_dir = tempfile.mkdtemp(prefix='catalogue-')
+        path = os.path.join(self._catalogue_dir, f'{catalogue.version}.pickle')
+        if path not in self._catalogue_files:
+            # Renamed into place so a worker never reads a partly written file
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(catalogue, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+            self._catalogue_files.append(path)
+            while len(self._catalogue_files) > CATALOGUE_FILES_KEPT:
+                os.remove(self._catalogue_files.popleft())
+        self._catalogue = (catalogue.version, path)
+        self.catalogue_version = catalogue.version
+
+    def warm_up(self, image):
+        """
+        Start the worker processes and run one analysis per job slot so the
+        first real requests do not pay for process start-up and detector init
+        Returns: Number of distinct worker processes that ran a warm-up analysis
+        """
+        with self._lock:
+            futures = [self._executor.submit(_warm_up, image, self._catalogue) for _ in range(self.workers)]
+        return len({future.result(timeout=self.timeout) for future in futures})
+
+    def shutdown(self):
+        """Stop the worker processes and remove the catalogue files"""
+        self._executor.shutdown(wait=True)
+        if self._catalogue_dir is not None:
+            shutil.rmtree(self._catalogue_dir, ignore_errors=True)
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.detector_options, self.stage_recorder is not None)
+        )
+
+    def _find_near_duplicate(self, image):
+        """
+        Look the image up in the near-duplicate index, hashing it here
+        Returns: (perceptual hash, reused detection result or None); the hash
+                 is None without an index or for undecodable images
+        """
+        if self.near_duplicates is None:
+            return None, None
+
+        with self.timer.stage('near_duplicate'):
+            phash = source_perceptual_hash(image)
+            match = self.near_duplicates.get(phash) if phash is not None else None
+        if match is None:
+            return phash, None
+
+        # The reused result keeps the earlier shot's leaf_region
+        result, distance = match
+        result['reused'] = True
+        result['reuse_distance'] = distance
+        return phash, result
+
+    def _remember(self, key, phash, result, version):
+        """Store a worker's result in the cache and near-duplicate index"""
+        if key is not None:
+            self.cache.put(key, result, version)
+        if phash is not None:
+            self.near_duplicates.put(phash, result, version)
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusyError('Analysis queue is full')
+
+        try:
+            with self._lock:
+                try:
+                    future = self._executor.submit(fn, *args)
+                except BrokenProcessPool:
+                    # A worker died; replace the pool so later jobs can run
+                    self._executor = self._new_executor()
+                    future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        # The slot is held until the job really finishes, even after a timeout
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _result(self, future):
+        """Returns: (result, detector rules_version it was computed under)"""
+        try:
+            result, stages, version = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise JobTimeoutError(f'Analysis did not finish within {self.timeout} seconds')
+
+        for stage, seconds in stages or ():
+            self.stage_recorder(stage, seconds)
+        return result, version
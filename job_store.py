@@ -0,0 +1,287 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Column order of the shared jobs table
+JOB_FIELDS = ('job_id', 'status', 'created', 'updated', 'version', 'result', 'error', 'key')
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already queued or running"""
+
+class JobStore:
+    """
+    In-process store for asynchronous diagnosis jobs. Jobs move through
+    queued -> running -> done/failed; finished jobs expire after ttl_seconds.
+    Waiters block on a condition until a job changes, which backs both
+    polling and server-sent events.
+    """
+
+    def __init__(self, ttl_seconds=600, max_active=64):
+        """
+        Args:
+            ttl_seconds: How long finished jobs stay retrievable
+            max_active: Queued + running jobs allowed before create() refuses
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_active = max_active
+
+        self._jobs = {}
+        self._by_key = {}
+        self._changed = threading.Condition()
+
+    def create(self, key=None):
+        """
+        Register a new queued job. If key (e.g. an image content hash) matches
+        a job that has not failed or expired, that job is returned instead so
+        client retries do not repeat the work.
+
+        Returns: (job snapshot, created) where created is False for a reused job
+        """
+        with self._changed:
+            self._expire()
+
+            if key is not None:
+                existing = self._jobs.get(self._by_key.get(key))
+                if existing is not None and existing['status'] != 'failed':
+                    return dict(existing), False
+
+            active = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if active >= self.max_active:
+                raise QueueFullError('Too many diagnosis jobs in progress')
+
+            now = time.time()
+            job = {
+                'job_id': uuid.uuid4().hex,
+                'status': 'queued',
+                'created': now,
+                'updated': now,
+                'version': 0,
+                'result': None,
+                'error': None,
+                'key': key
+            }
+            self._jobs[job['job_id']] = job
+            if key is not None:
+                self._by_key[key] = job['job_id']
+            return dict(job), True
+
+    def start(self, job_id):
+        """Mark a job as picked up by a runner"""
+        self._update(job_id, status='running')
+
+    def finish(self, job_id, result):
+        """Store the job's detection result"""
+        self._update(job_id, status='done', result=result)
+
+    def fail(self, job_id, error):
+        """Record why the job could not produce a result"""
+        self._update(job_id, status='failed', error=error)
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or None if unknown or expired"""
+        with self._changed:
+            self._expire()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, version, timeout):
+        """
+        Block until the job's version moves past version, it finishes, or
+        timeout seconds pass
+        Returns: Latest snapshot, or None if the job is gone
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job['version'] > version or job['status'] in ('done', 'failed'):
+                    return dict(job) if job else None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return dict(job)
+                self._changed.wait(remaining)
+
+    def _update(self, job_id, **changes):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(changes)
+            job['updated'] = time.time()
+            job['version'] += 1
+            self._changed.notify_all()
+
+    def _expire(self):
+        # Caller holds the lock
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['status'] in ('done', 'failed') and job['updated'] < cutoff
+        ]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if job['key'] is not None and self._by_key.get(job['key']) == job_id:
+                del self._by_key[job['key']]
+
+class SharedJobStore:
+    """
+    JobStore kept in a SQLite file, for servers that fork several worker
+    processes: a job created by one worker can be polled or streamed from
+    any other. Waiters cannot share a condition across processes, so wait()
+    re-reads the job every poll_interval seconds instead.
+    """
+
+    def __init__(self, db_path, ttl_seconds=600, max_active=64, poll_interval=0.25, stale_seconds=None):
+        """
+        Args:
+            db_path: SQLite file shared by every worker process
+            ttl_seconds: How long finished jobs stay retrievable; unfinished
+                jobs not updated for this long (their worker died) are dropped too
+            max_active: Queued + running jobs, across all workers, allowed before create() refuses
+            poll_interval: Seconds between reads while waiting for a job to change
+            stale_seconds: Unfinished jobs not updated for this long (their worker
+                probably died) are no longer joined by create() (None = always joined)
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_active = max_active
+        self.stale_seconds = stale_seconds
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        # Open now so a bad path fails at startup
+        self._db
+
+    @property
+    def _db(self):
+        """
+        SQLite connection for this process. A connection must not be used
+        across fork(), so each forked worker opens its own on first use.
+        """
+        if self._connection_pid != os.getpid():
+            # Autocommit mode; create() takes the write lock explicitly
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, status TEXT, created REAL, updated REAL, '
+                'version INTEGER, result TEXT, error TEXT, key TEXT)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)')
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def create(self, key=None):
+        """
+        Same contract as JobStore.create, except that unfinished jobs idle for
+        stale_seconds are not joined; the active-job limit covers every worker
+        """
+        with self._lock:
+            db = self._db
+            # Check and insert under one write lock so two workers cannot both create
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                self._expire()
+
+                if key is not None:
+                    # A queued or running job that stopped making progress may
+                    # belong to a worker that died; retries start a new one
+                    cutoff = time.time() - self.stale_seconds if self.stale_seconds is not None else 0
+                    existing = self._row(db.execute(
+                        "SELECT * FROM jobs WHERE key = ? AND (status = 'done' "
+                        "OR status IN ('queued', 'running') AND updated >= ?) ORDER BY created DESC LIMIT 1",
+                        (key, cutoff)
+                    ).fetchone())
+                    if existing is not None:
+                        db.execute('COMMIT')
+                        return existing, False
+
+                active = db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+                ).fetchone()[0]
+                if active >= self.max_active:
+                    raise QueueFullError('Too many diagnosis jobs in progress')
+
+                now = time.time()
+                job = {
+                    'job_id': uuid.uuid4().hex,
+                    'status': 'queued',
+                    'created': now,
+                    'updated': now,
+                    'version': 0,
+                    'result': None,
+                    'error': None,
+                    'key': key
+                }
+                db.execute(
+                    'INSERT INTO jobs (job_id, status, created, updated, version, result, error, key) '
+                    'VALUES (?, ?, ?, ?, ?, NULL, NULL, ?)',
+                    (job['job_id'], job['status'], now, now, 0, key)
+                )
+                db.execute('COMMIT')
+                return job, True
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def start(self, job_id):
+        """Mark a job as picked up by a runner"""
+        self._update(job_id, status='running')
+
+    def finish(self, job_id, result):
+        """Store the job's detection result"""
+        self._update(job_id, status='done', result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        """Record why the job could not produce a result"""
+        self._update(job_id, status='failed', error=error)
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or None if unknown or expired"""
+        with self._lock:
+            row = self._db.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        job = self._row(row)
+        if job is None or self._is_expired(job, time.time()):
+            return None
+        return job
+
+    def wait(self, job_id, version, timeout):
+        """Same contract as JobStore.wait, polling the shared file"""
+        deadline = time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['version'] > version or job['status'] in ('done', 'failed'):
+                return job
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return job
+            time.sleep(min(self.poll_interval, remaining))
+
+    def _update(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._db.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, updated = ?, version = version + 1 '
+                'WHERE job_id = ?',
+                (status, result, error, time.time(), job_id)
+            )
+
+    def _is_expired(self, job, now):
+        return job['updated'] < now - self.ttl_seconds
+
+    def _expire(self):
+        # Caller holds the lock
+        self._db.execute('DELETE FROM jobs WHERE updated < ?', (time.time() - self.ttl_seconds,))
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
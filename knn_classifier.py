@@ -0,0 +1,322 @@
+"""
+Nearest-Neighbour Classifier
+An alternative to the hand-tuned scoring rules: diagnoses an image by a
+k-nearest-neighbour vote among agronomist-labelled feature vectors.
+
+Features are standardized, and the labelled vectors are stored in the
+leaves of a KD-tree built by recursive median splits on the widest
+dimension. Each leaf holds at most leaf_size vectors, packed into one
+padded array together with its bounding box. A query visits leaves in
+order of their box distance: the nearest few leaves first, then, in one
+more pass, every leaf whose box is closer than the k-th neighbour found
+so far. Batches of queries are searched together, with the same handful
+of NumPy calls as a single query.
+
+The labelled set, scaling and tree are saved together in one .npz, so a
+server only reads arrays at startup and never rebuilds the tree. The file
+also records the feature settings of the scan the vectors came from
+(max_pixels, crop_leaf, CLASSIFIER_VERSION); a DiseaseDetector refuses a
+model whose settings differ from its own.
+
+Usage:
+    python knn_classifier.py labelled.csv --output knn_model.npz --k 5 --crop-leaf
+    (labelled.csv: a bulk scan CSV with a 'label' column of disease ids;
+     pass the same --crop-leaf/--max-pixels the scan was run with)
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+from disease_detector import FEATURE_NAMES, feature_settings
+
+# Upper bound on query x leaf x feature elements computed at once for leaf bounds
+BOUNDS_CHUNK_ELEMENTS = 1 << 22
+# Upper bound on vector elements gathered at once when scanning leaves
+GATHER_ELEMENTS = 1 << 22
+# Leaves scanned by the first pass of a search, to get a distance bound
+LEAF_BLOCK = 8
+
+def read_labelled_features(path, label_field='label'):
+    """
+    Read labelled feature vectors from a bulk scan result file (CSV with one
+    column per feature, or JSONL with a 'features' object) to which a label
+    column/field was added. Rows without a label are skipped.
+
+    Returns: (vectors [rows x features], list of labels)
+    """
+    vectors, labels = [], []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if Path(path).suffix.lower() == '.csv':
+            records = ((row, row) for row in csv.DictReader(f))
+        else:
+            records = ((record, record.get('features', {})) for record in map(json.loads, filter(str.strip, f)))
+
+        for record, features in records:
+            label = record.get(label_field)
+            if not label:
+                continue
+            try:
+                vectors.append([float(features[name]) for name in FEATURE_NAMES])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f'{path}: labelled row without all features: {record.get("path", record)}')
+            labels.append(label)
+
+    return np.array(vectors, dtype=np.float64).reshape(-1, len(FEATURE_NAMES)), labels
+
+def _build_kd_leaves(points, leaf_size):
+    """
+    Split points by the median of their widest dimension until every part
+    has at most leaf_size points
+    Returns: list of index arrays, one per leaf
+    """
+    leaves = []
+    pending = [np.arange(len(points))]
+    while pending:
+        indices = pending.pop()
+        if len(indices) <= leaf_size:
+            leaves.append(indices)
+            continue
+        part = points[indices]
+        dim = int(np.argmax(part.max(axis=0) - part.min(axis=0)))
+        half = len(indices) // 2
+        order = np.argpartition(part[:, dim], half)
+        pending.append(indices[order[half:]])
+        pending.append(indices[order[:half]])
+    return leaves
+
+class KNNClassifier:
+    """k-nearest-neighbour vote over labelled feature vectors (see module docstring)"""
+
+    def __init__(self, vectors, labels, k=5, leaf_size=32, settings=None):
+        """
+        Build the index from raw feature vectors
+
+        Args:
+            vectors: Array [samples x len(FEATURE_NAMES)] in FEATURE_NAMES order
+            labels: Disease id of each sample
+            k: Neighbours voting on each query
+            leaf_size: Maximum vectors per KD-tree leaf
+            settings: disease_detector.feature_settings() the vectors were
+                      extracted with (defaults to a detector's defaults)
+        """
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if vectors.ndim != 2 or vectors.shape[1] != len(FEATURE_NAMES) or len(vectors) == 0:
+            raise ValueError(f'Expected a non-empty [samples x {len(FEATURE_NAMES)}] feature array')
+        if len(labels) != len(vectors):
+            raise ValueError('Expected one label per feature vector')
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        settings = settings or feature_settings()
+
+        classes, codes = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+        mean = vectors.mean(axis=0)
+        scale = vectors.std(axis=0)
+        scale[scale == 0] = 1.0
+        points = ((vectors - mean) / scale).astype(np.float32)
+
+        leaves = _build_kd_leaves(points, leaf_size)
+        width = max(len(leaf) for leaf in leaves)
+        # Padding slots are zero vectors without a label (see _set_arrays)
+        leaf_points = np.zeros((len(leaves), width, points.shape[1]), dtype=np.float32)
+        leaf_labels = np.full((len(leaves), width), -1, dtype=np.int32)
+        for i, leaf in enumerate(leaves):
+            leaf_points[i, :len(leaf)] = points[leaf]
+            leaf_labels[i, :len(leaf)] = codes[leaf]
+
+        self._set_arrays({
+            'classes': classes,
+            'mean': mean,
+            'scale': scale,
+            'k': np.array(k),
+            'leaf_points': leaf_points,
+            'leaf_labels': leaf_labels,
+            'leaf_low': np.array([points[leaf].min(axis=0) for leaf in leaves]),
+            'leaf_high': np.array([points[leaf].max(axis=0) for leaf in leaves]),
+            'classifier_version': np.array(settings['classifier_version']),
+            # 0 stands for no limit: .npz arrays cannot hold None
+            'max_pixels': np.array(settings['max_pixels'] or 0),
+            'crop_leaf': np.array(settings['crop_leaf'])
+        })
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a classifier saved with save(); the tree is not rebuilt
+        Raises: ValueError if the file does not record its feature settings
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            missing = {'classifier_version', 'max_pixels', 'crop_leaf'} - set(arrays.files)
+            if missing:
+                raise ValueError(f'{path} does not record its feature settings ({", ".join(sorted(missing))}); rebuild it')
+            classifier = cls.__new__(cls)
+            classifier._set_arrays({name: arrays[name] for name in arrays.files})
+        return classifier
+
+    def save(self, path):
+        """Write the labelled vectors, scaling and tree to a .npz file"""
+        np.savez(path, **self._arrays)
+
+    def _set_arrays(self, arrays):
+        self._arrays = arrays
+        self.classes = [str(label) for label in arrays['classes']]
+        self.k = int(arrays['k'])
+        self.samples = int((arrays['leaf_labels'] >= 0).sum())
+        self.settings = {
+            'classifier_version': str(arrays['classifier_version']),
+            'max_pixels': int(arrays['max_pixels']) or None,
+            'crop_leaf': bool(arrays['crop_leaf'])
+        }
+        self._mean = arrays['mean']
+        self._scale = arrays['scale']
+        # One extra all-padding leaf pads queries that need fewer leaves than others in a chunk
+        leaf_points, leaf_labels = arrays['leaf_points'], arrays['leaf_labels']
+        self._empty_leaf = len(leaf_points)
+        self._leaf_points = np.concatenate([leaf_points, np.zeros_like(leaf_points[:1])])
+        self._leaf_labels = np.concatenate([leaf_labels, np.full_like(leaf_labels[:1], -1)])
+        # Squared norms for the |p|^2 - 2 p.q + |q|^2 expansion; padding is infinitely far away
+        self._leaf_norms = np.square(self._leaf_points).sum(axis=2)
+        self._leaf_norms[self._leaf_labels < 0] = np.inf
+        self._leaf_low = arrays['leaf_low']
+        self._leaf_high = arrays['leaf_high']
+
+        # Identifies the labelled set for cache versioning
+        digest = hashlib.sha256()
+        for name in sorted(arrays):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+        self.version = digest.hexdigest()[:16]
+
+    def kneighbors(self, vectors):
+        """
+        Find the k nearest labelled vectors of each query
+
+        Args:
+            vectors: Array [queries x len(FEATURE_NAMES)] of raw features
+
+        Returns: (squared standardized distances [queries x k], ascending;
+                  class indices into self.classes [queries x k], -1 where
+                  fewer than k samples exist)
+        """
+        queries = ((np.asarray(vectors, dtype=np.float64) - self._mean) / self._scale).astype(np.float32)
+        n_leaves, n_features = self._leaf_low.shape
+        step = max(1, BOUNDS_CHUNK_ELEMENTS // (n_leaves * n_features))
+
+        distances = np.empty((len(queries), self.k), dtype=np.float32)
+        labels = np.empty((len(queries), self.k), dtype=np.int32)
+        for start in range(0, len(queries), step):
+            chunk = slice(start, start + step)
+            distances[chunk], labels[chunk] = self._search(queries[chunk])
+        return distances, labels
+
+    def predict(self, vectors):
+        """
+        Majority vote of the k nearest labelled vectors; ties go to the
+        class of the single nearest one
+
+        Returns: List of (disease_id, vote share in percent, {disease_id: votes}) per query
+        """
+        _, labels = self.kneighbors(vectors)
+        votes = (labels[:, :, None] == np.arange(len(self.classes))).sum(axis=1)
+        tie_break = np.zeros(votes.shape)
+        tie_break[np.arange(len(labels)), labels[:, 0]] = 0.5
+        winners = np.argmax(votes + tie_break, axis=1)
+
+        predictions = []
+        for row, winner in enumerate(winners):
+            counts = {self.classes[c]: int(votes[row, c]) for c in np.flatnonzero(votes[row])}
+            predictions.append((self.classes[winner], 100.0 * votes[row, winner] / self.k, counts))
+        return predictions
+
+    def _search(self, queries):
+        """Exact k-NN for a chunk of standardized queries, visiting leaves nearest box first"""
+        # Squared distance from each query to each leaf's bounding box
+        nearest = np.minimum(np.maximum(queries[:, None, :], self._leaf_low), self._leaf_high)
+        bounds = np.square(nearest - queries[:, None, :]).sum(axis=2)
+        order = np.argsort(bounds, axis=1)
+
+        # First pass: the nearest few leaves give every query a k-th distance to beat
+        first = order[:, :LEAF_BLOCK]
+        distances, labels = self._scan_leaves(queries, first)
+        best_distances, best_labels = self._merge(None, None, distances, labels)
+
+        # Second pass: every other leaf whose box is closer than that. Boxes are
+        # sorted, so these are the next `remaining` leaves in each query's order.
+        rows = np.arange(len(queries))[:, None]
+        remaining = (bounds[rows, order[:, LEAF_BLOCK:]] < best_distances[:, -1:]).sum(axis=1)
+        pending = np.argsort(remaining)
+        pending = pending[remaining[pending] > 0]
+
+        leaf_elements = self._leaf_points.shape[1] * self._leaf_points.shape[2]
+        start = 0
+        while start < len(pending):
+            # Queries with similar leaf counts are scanned together, within a memory bound
+            end = start + 1
+            while (end < len(pending)
+                   and (end - start + 1) * remaining[pending[end]] * leaf_elements <= GATHER_ELEMENTS):
+                end += 1
+            chunk = pending[start:end]
+            width = remaining[chunk[-1]]
+
+            columns = np.arange(width)
+            leaves = np.where(columns < remaining[chunk, None],
+                              order[chunk, LEAF_BLOCK:LEAF_BLOCK + width], self._empty_leaf)
+            distances, labels = self._scan_leaves(queries[chunk], leaves)
+            best_distances[chunk], best_labels[chunk] = self._merge(
+                best_distances[chunk], best_labels[chunk], distances, labels
+            )
+            start = end
+
+        return best_distances, best_labels
+
+    def _scan_leaves(self, queries, leaves):
+        """Squared distances and labels of every vector in leaves [queries x leaves per query]"""
+        points = self._leaf_points[leaves].reshape(len(queries), -1, queries.shape[1])
+        distances = self._leaf_norms[leaves].reshape(len(queries), -1)
+        distances -= 2 * np.einsum('qpf,qf->qp', points, queries)
+        distances += np.square(queries).sum(axis=1)[:, None]
+        return distances, self._leaf_labels[leaves].reshape(len(queries), -1)
+
+    def _merge(self, best_distances, best_labels, distances, labels):
+        """Keep the k smallest distances per row, ascending"""
+        if best_distances is not None:
+            distances = np.concatenate([best_distances, distances], axis=1)
+            labels = np.concatenate([best_labels, labels], axis=1)
+        missing = self.k - distances.shape[1]
+        if missing > 0:
+            # Fewer labelled vectors than k
+            distances = np.hstack([distances, np.full((len(distances), missing), np.inf, dtype=distances.dtype)])
+            labels = np.hstack([labels, np.full((len(labels), missing), -1, dtype=labels.dtype)])
+        rows = np.arange(len(distances))[:, None]
+        if missing < 0:
+            nearest = np.argpartition(distances, self.k - 1, axis=1)[:, :self.k]
+            distances, labels = distances[rows, nearest], labels[rows, nearest]
+        ascending = np.argsort(distances, axis=1)
+        return distances[rows, ascending], labels[rows, ascending]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a nearest-neighbour classifier from labelled features')
+    parser.add_argument('labelled', help='Bulk scan CSV or JSONL with a label column/field')
+    parser.add_argument('--output', '-o', default='knn_model.npz', help='Classifier file to write')
+    parser.add_argument('--label-field', default='label', help='Column or field holding the disease id')
+    parser.add_argument('--k', type=int, default=5, help='Neighbours voting on each query')
+    parser.add_argument('--leaf-size', type=int, default=32, help='Maximum vectors per KD-tree leaf')
+    parser.add_argument('--max-pixels', type=int, help='--max-pixels the labelled scan was run with')
+    parser.add_argument('--crop-leaf', action='store_true', help='The labelled scan was run with --crop-leaf')
+    args = parser.parse_args()
+
+    vectors, labels = read_labelled_features(args.labelled, args.label_field)
+    classifier = KNNClassifier(vectors, labels, k=args.k, leaf_size=args.leaf_size,
+                               settings=feature_settings(args.max_pixels, args.crop_leaf))
+    classifier.save(args.output)
+    print(json.dumps({
+        'samples': classifier.samples,
+        'classes': classifier.classes,
+        'k': classifier.k,
+        'settings': classifier.settings,
+        'version': classifier.version
+    }, indent=2))
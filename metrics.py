@@ -0,0 +1,122 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class MetricsRegistry:
+    """
+    Minimal thread-safe counters, histograms and callback gauges rendered in
+    the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def counter(self, name, help_text):
+        self._declare(name, 'counter', help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._declare(name, 'histogram', help_text)
+        self._histograms.setdefault(name, {'buckets': tuple(buckets), 'series': {}})
+
+    def gauge(self, name, help_text, fn):
+        """Register a gauge whose value is read from fn() at render time"""
+        self._declare(name, 'gauge', help_text)
+        self._gauges[name] = fn
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        histogram = self._histograms[name]
+        label_key = _label_key(labels)
+        with self._lock:
+            series = histogram['series'].get(label_key)
+            if series is None:
+                series = histogram['series'][label_key] = {
+                    'counts': [0] * (len(histogram['buckets']) + 1), 'sum': 0.0, 'count': 0
+                }
+            series['counts'][bisect_left(histogram['buckets'], value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        """Return every metric in Prometheus text format"""
+        lines = []
+        with self._lock:
+            for name, metric_type in self._types.items():
+                lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {metric_type}')
+
+                if metric_type == 'counter':
+                    for (counter_name, label_key), value in self._counters.items():
+                        if counter_name == name:
+                            lines.append(f'{name}{_format_labels(label_key)} {value}')
+
+                elif metric_type == 'histogram':
+                    histogram = self._histograms[name]
+                    for label_key, series in histogram['series'].items():
+                        cumulative = 0
+                        for bound, count in zip(histogram['buckets'] + ('+Inf',), series['counts']):
+                            cumulative += count
+                            bucket_labels = label_key + (('le', str(bound)),)
+                            lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+                        lines.append(f'{name}_sum{_format_labels(label_key)} {series["sum"]}')
+                        lines.append(f'{name}_count{_format_labels(label_key)} {series["count"]}')
+
+                else:
+                    lines.append(f'{name} {self._gauges[name]()}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _declare(self, name, metric_type, help_text):
+        with self._lock:
+            self._types[name] = metric_type
+            self._help[name] = help_text
+
+class StageTimer:
+    """
+    Times named stages of one analysis and reports each duration to
+    recorder(stage, seconds). With no recorder every stage is a shared
+    no-op context, so disabled instrumentation costs almost nothing.
+    """
+
+    _NULL = nullcontext()
+
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+
+    def stage(self, name):
+        if self.recorder is None:
+            return self._NULL
+        return _Stage(self.recorder, name)
+
+class _Stage:
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.recorder(self.name, time.perf_counter() - self.start)
+        return False
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+def _format_labels(label_key):
+    if not label_key:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in label_key)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(label_key, escaped)) + '}'
@@ -0,0 +1,161 @@
+import json
+import threading
+import time
+from itertools import combinations
+
+import numpy as np
+
+# 64-bit hashes are split into this many 16-bit chunks for the lookup tables
+HASH_CHUNKS = 4
+CHUNK_BITS = 16
+
+# Set bits per byte value, for counting differing bits of many hashes at once
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def _chunk_masks(radius):
+    """Every CHUNK_BITS-bit XOR mask with at most radius bits set"""
+    masks = []
+    for flipped in range(radius + 1):
+        for bits in combinations(range(CHUNK_BITS), flipped):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            masks.append(mask)
+    return masks
+
+def _chunks(phash):
+    mask = (1 << CHUNK_BITS) - 1
+    return [(phash >> (i * CHUNK_BITS)) & mask for i in range(HASH_CHUNKS)]
+
+class NearDuplicateIndex:
+    """
+    Recent detection results keyed by 64-bit perceptual image hash, for
+    reusing a diagnosis when a near-identical photo (another shot of the
+    same burst) comes in. Lookups use a multi-index hash: each hash is
+    filed under its four 16-bit chunks, and two hashes within max_distance
+    bits must agree on some chunk to within max_distance // 4 bits, so a
+    lookup probes a few table entries and compares only the hashes found
+    there. Hashes live in a fixed-size ring of slots; when it is full the
+    oldest entry is overwritten. Like ResultCache, entries are tagged with
+    a version and cleared when it changes.
+    """
+
+    def __init__(self, max_distance=4, max_entries=100000, max_age_seconds=600):
+        """
+        Args:
+            max_distance: Largest Hamming distance (bits of 64) treated as the same photo
+            max_entries: Hashes kept (preallocated); the oldest are overwritten first
+            max_age_seconds: Age after which an entry is no longer reused (None = never)
+        """
+        if not 0 <= max_distance < 64:
+            raise ValueError('max_distance must be between 0 and 63')
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.version = ''
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._masks = _chunk_masks(max_distance // HASH_CHUNKS)
+        self._clear()
+
+    def __getstate__(self):
+        # Pickled copies (e.g. in detector options) get the settings and an empty index
+        return {
+            'max_distance': self.max_distance,
+            'max_entries': self.max_entries,
+            'max_age_seconds': self.max_age_seconds
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def set_version(self, version):
+        """Switch to a new catalogue/rules version, dropping results from other versions"""
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self._clear()
+
+    def get(self, phash):
+        """
+        Find the closest stored hash within max_distance of phash
+        Returns: (copy of its result, distance), or None
+        """
+        now = time.time()
+        with self._lock:
+            slots = []
+            for table, chunk in zip(self._tables, _chunks(phash)):
+                for mask in self._masks:
+                    found = table.get(chunk ^ mask)
+                    if found:
+                        slots.extend(found)
+
+            result = None
+            if slots:
+                slots = np.array(slots, dtype=np.intp)
+                differing = (self._hashes[slots] ^ np.uint64(phash)).view(np.uint8)
+                distances = POPCOUNT[differing].reshape(-1, 8).sum(axis=1)
+                if self.max_age_seconds is not None:
+                    distances[self._created[slots] < now - self.max_age_seconds] = 64
+                best = int(distances.argmin())
+                if distances[best] <= self.max_distance:
+                    result, distance = self._results[slots[best]], int(distances[best])
+
+            if result is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['hits'] += 1
+        return json.loads(result), distance
+
+    def put(self, phash, result, version=None):
+        """
+        Remember the result for an analyzed image's hash. If version is given
+        and no longer current, the result is dropped.
+        """
+        created = time.time()
+        # Stored serialized so callers can never mutate a stored entry
+        serialized = json.dumps(result)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+
+            slot = self._next
+            self._next = (slot + 1) % self.max_entries
+            if self._results[slot] is not None:
+                self._forget(slot)
+            else:
+                self._size += 1
+
+            self._hashes[slot] = phash
+            self._created[slot] = created
+            self._results[slot] = serialized
+            for table, chunk in zip(self._tables, _chunks(phash)):
+                table.setdefault(chunk, []).append(slot)
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = self._size
+            stats['max_entries'] = self.max_entries
+            return stats
+
+    def _clear(self):
+        # Caller holds the lock (or is __init__)
+        self._hashes = np.zeros(self.max_entries, dtype=np.uint64)
+        self._created = np.zeros(self.max_entries)
+        self._results = [None] * self.max_entries
+        self._tables = [{} for _ in range(HASH_CHUNKS)]
+        self._next = 0
+        self._size = 0
+
+    def _forget(self, slot):
+        # Caller holds the lock
+        for table, chunk in zip(self._tables, _chunks(int(self._hashes[slot]))):
+            slots = table[chunk]
+            slots.remove(slot)
+            if not slots:
+                del table[chunk]
+        self._results[slot] = None
+        self._counters['evictions'] += 1
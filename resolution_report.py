@@ -0,0 +1,135 @@
+"""
+Resolution Accuracy-Drift Report
+Compares every extracted feature and the predicted disease at several
+analysis resolutions against the full-resolution result, to pick the
+smallest DiseaseDetector(max_pixels=...) that keeps the same diagnosis.
+
+Usage:
+    python resolution_report.py photos/*.jpg --levels 0.25 0.5 1 2 --crop-leaf --json report.json
+"""
+
+import argparse
+import json
+import cv2
+from disease_detector import DiseaseDetector, downsample_to
+
+DEFAULT_LEVELS_MP = [0.1, 0.25, 0.5, 1, 2, 4]
+
+def analyze_at_levels(detector, img, levels_mp):
+    """
+    Analyze one image at full resolution and at each pyramid level, through
+    the detector's full analysis so its crop_leaf and classifier apply
+
+    Args:
+        detector: DiseaseDetector without max_pixels (the levels set the resolution)
+
+    Returns: (full-resolution result, {level_mp: result})
+    """
+    if detector.max_pixels is not None:
+        raise ValueError('analyze_at_levels needs a detector without max_pixels')
+
+    full = detector.analyze_image(img)
+    levels = {}
+    for level in levels_mp:
+        # Every level is taken from the full image so errors do not compound
+        levels[level] = detector.analyze_image(downsample_to(img, int(level * 1_000_000)))
+    return full, levels
+
+def build_report(image_paths, levels_mp, crop_leaf=False):
+    """
+    Collect per-feature drift and diagnosis agreement for every level
+
+    Args:
+        crop_leaf: Analyze only the leaf region, as the app does with ANALYSIS_CROP_LEAF
+
+    Returns: Report dict with per-level summaries and a recommended level
+    """
+    detector = DiseaseDetector(crop_leaf=crop_leaf)
+    levels_mp = sorted(levels_mp)
+    summary = {
+        level: {'images': 0, 'same_disease': 0, 'same_severity': 0, 'max_abs_drift': {}}
+        for level in levels_mp
+    }
+    images = []
+
+    for path in image_paths:
+        img = cv2.imread(str(path))
+        if img is None:
+            images.append({'path': str(path), 'error': 'Failed to read image'})
+            continue
+
+        full, levels = analyze_at_levels(detector, img, levels_mp)
+        entry = {
+            'path': str(path),
+            'megapixels': round(img.shape[0] * img.shape[1] / 1_000_000, 2),
+            'disease_id': full['disease_id'],
+            'levels': {}
+        }
+
+        for level, result in levels.items():
+            drift = {
+                name: abs(float(result['features'][name]) - float(value))
+                for name, value in full['features'].items()
+            }
+            stats = summary[level]
+            stats['images'] += 1
+            stats['same_disease'] += result['disease_id'] == full['disease_id']
+            stats['same_severity'] += result['severity'] == full['severity']
+            for name, value in drift.items():
+                stats['max_abs_drift'][name] = max(stats['max_abs_drift'].get(name, 0.0), value)
+
+            entry['levels'][level] = {
+                'disease_id': result['disease_id'],
+                'severity': result['severity'],
+                'confidence_drift': round(abs(float(result['confidence']) - float(full['confidence'])), 4),
+                'feature_drift': {name: round(value, 4) for name, value in drift.items()}
+            }
+
+        images.append(entry)
+
+    # Smallest level that keeps every image's diagnosis
+    recommended = next(
+        (level for level in levels_mp
+         if summary[level]['images'] and summary[level]['same_disease'] == summary[level]['images']),
+        None
+    )
+
+    return {
+        'levels_mp': levels_mp,
+        'summary': summary,
+        'recommended_max_pixels': int(recommended * 1_000_000) if recommended else None,
+        'images': images
+    }
+
+def print_report(report):
+    """Print a compact per-level table"""
+    print(f"{'MP':>6} {'images':>7} {'same disease':>13} {'same severity':>14}  worst feature drift")
+    for level in report['levels_mp']:
+        stats = report['summary'][level]
+        drift = stats['max_abs_drift']
+        worst = max(drift, key=drift.get) if drift else '-'
+        worst_value = f"{drift[worst]:.3f}" if drift else ''
+        print(f"{level:>6} {stats['images']:>7} {stats['same_disease']:>13} {stats['same_severity']:>14}  "
+              f"{worst} {worst_value}")
+
+    if report['recommended_max_pixels']:
+        print(f"\nRecommended max_pixels: {report['recommended_max_pixels']}")
+    else:
+        print('\nNo level kept every diagnosis; keep full resolution')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Feature drift of downsampled analysis vs full resolution')
+    parser.add_argument('images', nargs='+', help='Image files to compare')
+    parser.add_argument('--levels', nargs='+', type=float, default=DEFAULT_LEVELS_MP,
+                        help='Analysis resolutions in megapixels')
+    parser.add_argument('--json', help='Also write the full report to this file')
+    parser.add_argument('--crop-leaf', action='store_true', help='Analyze only the leaf region, like the app')
+    args = parser.parse_args()
+
+    report = build_report(args.images, args.levels, crop_leaf=args.crop_leaf)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class ResultCache:
+    """
+    Two-tier cache for detection results keyed by image content hash.
+    An in-memory LRU tier sits in front of an optional SQLite file that
+    survives restarts. Every entry is tagged with a version string; changing
+    the version (new disease catalogue or classifier rules) drops old entries.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=24 * 3600, db_path=None):
+        """
+        Args:
+            max_entries: Maximum number of results kept in memory
+            ttl_seconds: Age after which an entry is ignored (None = never expires)
+            db_path: Optional SQLite file for the persistent tier
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = ''
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+        self.db_path = db_path
+        self._connection = None
+        self._connection_pid = None
+        # Open now so a bad path fails at startup
+        self._db
+
+    @property
+    def _db(self):
+        """
+        SQLite connection for this process, or None without a db_path. A
+        connection must not be used across fork(), so a forked worker
+        (e.g. under a preloading server) opens its own on first use.
+        """
+        if not self.db_path:
+            return None
+        if self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, version TEXT, created REAL, result TEXT)'
+            )
+            self._connection.commit()
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def set_version(self, version):
+        """Switch to a new catalogue/rules version, dropping entries from other versions"""
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM results WHERE version != ?', (version,))
+                self._db.commit()
+
+    def get(self, key):
+        """Return the cached result for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, result = entry
+                if not self._expired(created, now):
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    self._counters['memory_hits'] += 1
+                    return json.loads(result)
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT created, result FROM results WHERE key = ? AND version = ?',
+                    (key, self.version)
+                ).fetchone()
+                if row is not None:
+                    created, result = row
+                    if not self._expired(created, now):
+                        self._remember(key, created, result)
+                        self._counters['hits'] += 1
+                        self._counters['disk_hits'] += 1
+                        return json.loads(result)
+                    self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                    self._db.commit()
+
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, key, result, version=None):
+        """
+        Store a JSON-serializable result under key. If version is given and
+        no longer current (the catalogue changed while the result was being
+        computed), the result is dropped.
+        """
+        created = time.time()
+        # Stored serialized so callers can never mutate a cached entry
+        serialized = json.dumps(result)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._remember(key, created, serialized)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO results (key, version, created, result) VALUES (?, ?, ?, ?)',
+                    (key, self.version, created, serialized)
+                )
+                self._db.commit()
+
+    def clear(self):
+        """Remove all entries from both tiers"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.commit()
+
+    def stats(self):
+        """Hit/miss counters and current size, for sizing the cache"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+            if self._db is not None:
+                stats['disk_entries'] = self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            return stats
+
+    def _expired(self, created, now):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def _remember(self, key, created, serialized):
+        # Caller holds the lock
+        self._entries[key] = (created, serialized)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
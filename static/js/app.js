@@ -1,5 +1,6 @@
 // Global state
 let detectionResult = null;
+let treatmentData = null;
 let selectedTreatmentType = null;
 
 // DOM Elements
@@ -15,6 +16,13 @@ const organicForm = document.getElementById('organicForm');
 const inorganicForm = document.getElementById('inorganicForm');
 const treatmentResults = document.getElementById('treatmentResults');
 
+// Give up on a diagnosis job after this long; the server process running it may have died
+const JOB_WAIT_LIMIT_MS = 2 * 60 * 1000;
+
+// Preferred upload size and encodings, embedded in the page by the server
+const uploadSettings = JSON.parse(document.body.dataset.uploadSettings || 'null');
+const UPLOAD_EXTENSIONS = { 'image/webp': 'webp', 'image/jpeg': 'jpg' };
+
 // Upload area click handler
 uploadArea.addEventListener('click', () => {
     imageInput.click();
@@ -72,23 +80,40 @@ analyzeBtn.addEventListener('click', async () => {
         return;
     }
 
-    const formData = new FormData();
-    formData.append('image', file);
-
     loading.classList.add('active');
     analyzeBtn.disabled = true;
     resultsSection.classList.remove('active');
 
+    const upload = await prepareUpload(file);
+    const formData = new FormData();
+    formData.append('image', upload, upload.name);
+
+    // With a motor capacity already entered, the dosage comes back with the diagnosis
+    const motorCapacity = document.getElementById('motorCapacity').value;
+    if (motorCapacity) {
+        formData.append('motor_capacity', motorCapacity);
+    }
+
     try {
-        const response = await fetch('/api/upload', {
+        // Queue the diagnosis; the server answers immediately with a job id
+        const response = await fetch('/api/jobs', {
             method: 'POST',
             body: formData
         });
 
-        const data = await response.json();
+        const job = await response.json();
+
+        if (!response.ok) {
+            showAlert(job.error || 'Failed to analyze image', 'error');
+            return;
+        }
 
-        if (data.success) {
+        // The finished job carries the detection plus organic and inorganic treatments
+        const data = await waitForJob(job);
+
+        if (data.status === 'done') {
             detectionResult = data.detection;
+            treatmentData = data.treatments;
             displayResults(data.detection);
         } else {
             showAlert(data.error || 'Failed to analyze image', 'error');
@@ -101,6 +126,99 @@ analyzeBtn.addEventListener('click', async () => {
     }
 });
 
+// Wait for a diagnosis job to finish, via server-sent events when available
+function waitForJob(job) {
+    if (job.status === 'done' || job.status === 'failed') {
+        return Promise.resolve(job);
+    }
+
+    const deadline = Date.now() + JOB_WAIT_LIMIT_MS;
+    if (!window.EventSource) {
+        return pollJob(job.status_url, deadline);
+    }
+
+    return new Promise((resolve) => {
+        const source = new EventSource(job.events_url);
+        const timer = setTimeout(() => {
+            source.close();
+            resolve(jobTimedOut());
+        }, JOB_WAIT_LIMIT_MS);
+        const finish = (e) => {
+            clearTimeout(timer);
+            source.close();
+            resolve(JSON.parse(e.data));
+        };
+
+        source.addEventListener('done', finish);
+        source.addEventListener('failed', finish);
+
+        // Proxies that break the stream fall back to polling
+        source.onerror = () => {
+            clearTimeout(timer);
+            source.close();
+            resolve(pollJob(job.status_url, deadline));
+        };
+    });
+}
+
+// Poll a diagnosis job until it finishes or the deadline (ms timestamp) passes
+async function pollJob(statusUrl, deadline) {
+    while (Date.now() < deadline) {
+        const response = await fetch(statusUrl);
+        const data = await response.json();
+
+        if (!response.ok || data.status === 'done' || data.status === 'failed') {
+            return data.status ? data : { status: 'failed', error: data.error };
+        }
+
+        await new Promise(resolve => setTimeout(resolve, 1500));
+    }
+    return jobTimedOut();
+}
+
+function jobTimedOut() {
+    return { status: 'failed', error: 'The diagnosis is taking too long. Please try again.' };
+}
+
+// Shrink the photo to the server's preferred size and recompress it before
+// upload. The original file is sent when the browser cannot decode or
+// re-encode it, or when recompression would not make it smaller.
+async function prepareUpload(file) {
+    if (!uploadSettings || !window.createImageBitmap) return file;
+
+    let bitmap;
+    try {
+        bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+    } catch (error) {
+        return file;
+    }
+
+    const { width, height } = bitmap;
+    let scale = Math.min(1, uploadSettings.max_dimension / Math.max(width, height));
+    if (uploadSettings.max_pixels) {
+        scale = Math.min(scale, Math.sqrt(uploadSettings.max_pixels / (width * height)));
+    }
+
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.max(1, Math.round(width * scale));
+    canvas.height = Math.max(1, Math.round(height * scale));
+    const ctx = canvas.getContext('2d');
+    ctx.imageSmoothingQuality = 'high';
+    ctx.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+
+    for (const type of uploadSettings.formats) {
+        const blob = await new Promise(resolve => canvas.toBlob(resolve, type, uploadSettings.quality));
+        // Browsers that cannot encode a type fall back to PNG; try the next one
+        if (!blob || blob.type !== type) continue;
+        if (blob.size >= file.size) return file;
+
+        const baseName = file.name.replace(/\.[^.]*$/, '') || 'upload';
+        return new File([blob], `${baseName}.${UPLOAD_EXTENSIONS[type]}`, { type });
+    }
+    return file;
+}
+
 // Display detection results
 function displayResults(detection) {
     document.getElementById('diseaseName').textContent = detection.disease_name;
@@ -110,13 +228,61 @@ function displayResults(detection) {
     severityBadge.textContent = detection.severity.toUpperCase();
     severityBadge.className = `severity-badge severity-${detection.severity}`;
 
-    document.getElementById('confidenceValue').textContent = `${detection.confidence}%`;
+    // Near-identical shots of the same leaf share the first shot's diagnosis
+    document.getElementById('confidenceValue').textContent = detection.reused
+        ? `${detection.confidence}% (same as a recent near-identical photo)`
+        : `${detection.confidence}%`;
+    showLeafRegion(detection.leaf_region);
 
     resultsSection.classList.add('active');
     treatmentForm.classList.remove('active');
     treatmentResults.classList.remove('active');
 }
 
+// Show which part of the photo was analyzed: the leaf mask is highlighted
+// and the cropped bounding box outlined on top of the preview
+function showLeafRegion(region) {
+    const container = document.getElementById('leafRegion');
+    if (!region || !region.cropped) {
+        container.classList.remove('active');
+        return;
+    }
+
+    const maskImg = new Image();
+    maskImg.onload = () => {
+        const canvas = document.getElementById('leafRegionCanvas');
+        const scale = Math.min(1, 600 / region.image_width);
+        canvas.width = Math.round(region.image_width * scale);
+        canvas.height = Math.round(region.image_height * scale);
+        const ctx = canvas.getContext('2d');
+        ctx.drawImage(previewImg, 0, 0, canvas.width, canvas.height);
+
+        // Turn the grayscale mask into a shade that covers everything but the leaf
+        const shade = document.createElement('canvas');
+        shade.width = maskImg.width;
+        shade.height = maskImg.height;
+        const shadeCtx = shade.getContext('2d');
+        shadeCtx.drawImage(maskImg, 0, 0);
+        const pixels = shadeCtx.getImageData(0, 0, shade.width, shade.height);
+        for (let i = 0; i < pixels.data.length; i += 4) {
+            const alpha = pixels.data[i] ? 0 : 140;
+            pixels.data[i] = pixels.data[i + 1] = pixels.data[i + 2] = 0;
+            pixels.data[i + 3] = alpha;
+        }
+        shadeCtx.putImageData(pixels, 0, 0);
+        ctx.drawImage(shade, 0, 0, canvas.width, canvas.height);
+
+        ctx.strokeStyle = getComputedStyle(document.documentElement).getPropertyValue('--accent-green').trim();
+        ctx.lineWidth = 2;
+        ctx.strokeRect(region.x * scale, region.y * scale, region.width * scale, region.height * scale);
+
+        document.getElementById('leafRegionValue').textContent =
+            `${Math.round(region.analyzed_fraction * 100)}%`;
+        container.classList.add('active');
+    };
+    maskImg.src = region.mask;
+}
+
 // Treatment type selection
 function selectTreatment(type) {
     selectedTreatmentType = type;
@@ -145,26 +311,17 @@ function selectTreatment(type) {
 async function getOrganicTreatment() {
     if (!detectionResult) return;
 
+    // Already delivered with the diagnosis
+    if (treatmentData && treatmentData.organic) {
+        showOrganicTreatment(treatmentData.organic);
+        return;
+    }
+
     loading.classList.add('active');
 
     try {
-        const response = await fetch('/api/treatment/organic', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                disease_id: detectionResult.disease_id
-            })
-        });
-
-        const data = await response.json();
-
-        if (data.error) {
-            showAlert(data.error, 'error');
-        } else {
-            displayOrganicRecipe(data.recipe);
-        }
+        const response = await fetch(`/api/treatment/organic/${encodeURIComponent(detectionResult.disease_id)}`);
+        showOrganicTreatment(await response.json());
     } catch (error) {
         showAlert('Error fetching treatment: ' + error.message, 'error');
     } finally {
@@ -172,6 +329,14 @@ async function getOrganicTreatment() {
     }
 }
 
+function showOrganicTreatment(data) {
+    if (data.error) {
+        showAlert(data.error, 'error');
+    } else {
+        displayOrganicRecipe(data.recipe);
+    }
+}
+
 // Display organic recipe
 function displayOrganicRecipe(recipe) {
     organicForm.classList.add('active');
@@ -214,35 +379,40 @@ function displayOrganicRecipe(recipe) {
 async function loadChemicalOptions() {
     if (!detectionResult) return;
 
-    try {
-        const response = await fetch('/api/treatment/inorganic/options', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                disease_id: detectionResult.disease_id
-            })
-        });
-
-        const data = await response.json();
-
-        if (data.available_chemicals) {
-            const select = document.getElementById('chemicalSelect');
-            select.innerHTML = '<option value="">Select a chemical...</option>';
+    // Already delivered with the diagnosis, possibly with a ready dosage
+    if (treatmentData && treatmentData.inorganic) {
+        fillChemicalOptions(treatmentData.inorganic);
 
-            data.available_chemicals.forEach(chemical => {
-                const option = document.createElement('option');
-                option.value = chemical.name;
-                option.textContent = `${chemical.name} (${chemical.concentration})`;
-                select.appendChild(option);
-            });
+        const dosage = treatmentData.default_dosage;
+        if (dosage && !dosage.error) {
+            document.getElementById('chemicalSelect').value = dosage.chemical_details.name;
+            displayInorganicDosage(dosage);
         }
+        return;
+    }
+
+    try {
+        const response = await fetch(`/api/treatment/inorganic/options/${encodeURIComponent(detectionResult.disease_id)}`);
+        fillChemicalOptions(await response.json());
     } catch (error) {
         showAlert('Error loading chemicals: ' + error.message, 'error');
     }
 }
 
+function fillChemicalOptions(data) {
+    if (!data.available_chemicals) return;
+
+    const select = document.getElementById('chemicalSelect');
+    select.innerHTML = '<option value="">Select a chemical...</option>';
+
+    data.available_chemicals.forEach(chemical => {
+        const option = document.createElement('option');
+        option.value = chemical.name;
+        option.textContent = `${chemical.name} (${chemical.concentration})`;
+        select.appendChild(option);
+    });
+}
+
 // Calculate inorganic dosage
 document.getElementById('calculateBtn').addEventListener('click', async () => {
     const chemicalName = document.getElementById('chemicalSelect').value;
@@ -366,10 +536,12 @@ function showAlert(message, type) {
 // Reset application
 function resetApp() {
     detectionResult = null;
+    treatmentData = null;
     selectedTreatmentType = null;
     imageInput.value = '';
     imagePreview.classList.remove('active');
     resultsSection.classList.remove('active');
+    document.getElementById('leafRegion').classList.remove('active');
     treatmentForm.classList.remove('active');
     treatmentResults.classList.remove('active');
     analyzeBtn.disabled = true;
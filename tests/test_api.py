@@ -0,0 +1,102 @@
+import io
+import os
+import time
+
+import pytest
+
+# Analyze in the test process, with in-process jobs
+os.environ['INFERENCE_WORKERS'] = '0'
+os.environ.pop('JOB_STORE_DB', None)
+
+import app as server
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(server.app.config, 'SAVE_UPLOADS', False)
+    server.result_cache.clear()
+    return server.app.test_client()
+
+def image_form(**fields):
+    return {'image': (io.BytesIO(server.warm_up_image()), 'leaf.jpg'), **fields}
+
+def wait_for_job(client, job):
+    for _ in range(100):
+        job = client.get(job['status_url']).get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError('job did not finish')
+
+@pytest.mark.parametrize('route', ['/api/upload', '/api/diagnose', '/api/jobs'])
+@pytest.mark.parametrize('upload, error', [
+    (None, 'No image file provided'),
+    ('', 'No file selected'),
+    ('notes.txt', 'Invalid file type. Please upload an image file.'),
+])
+def test_upload_checks(client, route, upload, error):
+    form = {} if upload is None else {'image': (io.BytesIO(b'x'), upload)}
+    response = client.post(route, data=form)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+
+def test_job_carries_treatments_like_diagnose(client):
+    fields = {'motor_capacity': '15'}
+    diagnosed = client.post('/api/diagnose', data=image_form(**fields)).get_json()
+
+    response = client.post('/api/jobs', data=image_form(**fields))
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json())
+
+    assert job['status'] == 'done'
+    assert job['detection'] == diagnosed['detection']
+    assert job['treatments'] == diagnosed['treatments']
+    assert 'default_dosage' in job['treatments']
+
+def test_jobs_with_other_treatment_fields_are_not_joined(client):
+    first = client.post('/api/jobs', data=image_form(motor_capacity='15')).get_json()
+    second = client.post('/api/jobs', data=image_form(motor_capacity='20')).get_json()
+    again = client.post('/api/jobs', data=image_form(motor_capacity='15')).get_json()
+
+    assert first['job_id'] != second['job_id']
+    assert first['job_id'] == again['job_id']
+
+def test_invalid_numbers_are_rejected(client):
+    for route in ('/api/diagnose', '/api/jobs'):
+        response = client.post(route, data=image_form(motor_capacity='lots'))
+        assert response.status_code == 400
+
+def test_busy_analyzer_answers_503(client, monkeypatch):
+    def busy(image):
+        raise server.PoolBusyError('Analysis queue is full')
+    monkeypatch.setattr(server.analyzer, 'analyze_image', busy)
+
+    for route in ('/api/upload', '/api/diagnose'):
+        response = client.post(route, data=image_form())
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(server.app.config['INFERENCE_RETRY_AFTER'])
+
+def test_uploads_past_the_write_backlog_are_not_stored(client, monkeypatch):
+    stored = []
+    monkeypatch.setitem(server.app.config, 'SAVE_UPLOADS', True)
+    monkeypatch.setattr(server.upload_store, 'put', stored.append)
+    image = server.warm_up_image()
+
+    monkeypatch.setitem(server.app.config, 'UPLOAD_WRITE_MAX_PENDING', len(image) - 1)
+    assert client.post('/api/upload', data=image_form()).status_code == 200
+    monkeypatch.setitem(server.app.config, 'UPLOAD_WRITE_MAX_PENDING', len(image))
+    assert client.post('/api/upload', data=image_form()).status_code == 200
+
+    server.upload_writer.submit(lambda: None).result()
+    assert stored == [image]
+    assert server.upload_backlog['bytes'] == 0
+
+@pytest.mark.parametrize('spray_volume, status', [(None, 200), (0, 400), (-5, 400), ('nan', 400), ('lots', 400)])
+def test_plan_spray_volume(client, spray_volume, status):
+    disease_id, _ = next(iter(server.advisor.catalogue.chemical_index))
+    chemical = server.advisor.get_inorganic_options(disease_id)['available_chemicals'][0]['name']
+    body = {'rows': [{'disease_id': disease_id, 'chemical_name': chemical, 'motor_capacity': 15}]}
+    if spray_volume is not None:
+        body['spray_volume_per_acre'] = spray_volume
+
+    response = client.post('/api/treatment/inorganic/plan', json=body)
+    assert response.status_code == status
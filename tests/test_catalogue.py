@@ -0,0 +1,43 @@
+import json
+import shutil
+
+import pytest
+
+from catalogue import DATA_DIR, CatalogueWatcher
+
+@pytest.fixture
+def data_dir(tmp_path):
+    shutil.copytree(DATA_DIR, tmp_path / 'data')
+    return tmp_path / 'data'
+
+def edit(data_dir, name, change):
+    path = data_dir / name
+    data = json.loads(path.read_text())
+    change(data)
+    path.write_text(json.dumps(data))
+
+def first_chemical(data):
+    return next(entries for entries in data['chemicals'].values() if entries)[0]
+
+def test_unexpected_error_in_bad_edit_is_recorded(data_dir):
+    watcher = CatalogueWatcher(data_dir)
+    version = watcher.current.version
+
+    edit(data_dir, 'inorganic_chemicals.json', lambda data: first_chemical(data).update(mixing_ratio='1:400'))
+    assert watcher.check() is False
+    assert watcher.last_error.startswith('ValueError: Mixing ratio')
+    assert watcher.current.version == version
+
+def test_failing_listener_is_recorded_and_others_still_run(data_dir):
+    watcher = CatalogueWatcher(data_dir)
+    seen = []
+
+    def locked(snapshot):
+        raise RuntimeError('database is locked')
+    watcher.subscribe(locked)
+    watcher.subscribe(seen.append)
+
+    edit(data_dir, 'diseases.json', lambda data: data['diseases'][0].update(description='Edited'))
+    assert watcher.check() is True
+    assert seen == [watcher.current]
+    assert 'database is locked' in watcher.last_error
@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+import pytest
+
+from disease_detector import (
+    BAND_BINS, BAND_BOXES, BAND_LUTS, COLOR_BANDS, HIST_CHUNK_PIXELS,
+    DiseaseDetector, _build_band_tables, compile_scoring_rules
+)
+
+@pytest.fixture(scope='module')
+def every_hsv():
+    """One pixel for every (h, s, v) byte triple, as three 4096 x 4096 planes"""
+    values = np.arange(1 << 24, dtype=np.uint32)
+    planes = [((values >> shift) & 0xFF).astype(np.uint8).reshape(4096, 4096) for shift in (16, 8, 0)]
+    return planes
+
+@pytest.fixture(scope='module')
+def detectors():
+    return {fused: DiseaseDetector(fused_bands=fused) for fused in (True, False)}
+
+def band_features(detector, img, workspace=None):
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    features = detector._extract_features(img, hsv, None, workspace)
+    return {f'{band}_percentage': features[f'{band}_percentage'] for band in COLOR_BANDS}
+
+def test_band_tables_are_module_tables():
+    luts, bins, boxes = _build_band_tables()
+    assert bins == BAND_BINS
+    assert boxes == BAND_BOXES
+    for lut, expected in zip(luts, BAND_LUTS):
+        assert np.array_equal(lut, expected)
+
+def test_every_hsv_value_lands_in_the_same_bands(every_hsv, detectors):
+    h, s, v = every_hsv
+    codes = detectors[True]._band_codes(h, s, v)
+    strides = (BAND_BINS[1] * BAND_BINS[2], BAND_BINS[2], 1)
+    bins = [(codes // stride) % size for stride, size in zip(strides, BAND_BINS)]
+    hsv = cv2.merge([h, s, v])
+
+    for band, (lower, upper) in COLOR_BANDS.items():
+        in_box = np.ones(codes.shape, dtype=bool)
+        for channel_bins, box in zip(bins, BAND_BOXES[band]):
+            in_box &= (channel_bins >= box.start) & (channel_bins < box.stop)
+        in_range = cv2.inRange(hsv, lower, upper) > 0
+        assert np.array_equal(in_box, in_range), band
+
+def test_band_counts_match_masks_for_every_hsv_value(every_hsv, detectors):
+    h, s, v = every_hsv
+    counts = detectors[True]._band_counts(detectors[True]._band_codes(h, s, v))
+    hsv = cv2.merge([h, s, v])
+    for band, (lower, upper) in COLOR_BANDS.items():
+        assert counts[band] == cv2.countNonZero(cv2.inRange(hsv, lower, upper)), band
+
+@pytest.mark.parametrize('shape', [(1, 1), (37, 53), (480, 640), (1200, 1600)])
+def test_fused_features_match_masks_on_random_images(shape, detectors):
+    img = np.random.default_rng(sum(shape)).integers(0, 256, (*shape, 3), dtype=np.uint8)
+    assert band_features(detectors[True], img) == band_features(detectors[False], img)
+
+def test_fused_features_match_masks_with_workspace(detectors):
+    fused = DiseaseDetector(fused_bands=True, reuse_buffers=True, catalogue=detectors[True].catalogue)
+    masks = DiseaseDetector(fused_bands=False, reuse_buffers=True, catalogue=detectors[True].catalogue)
+    rng = np.random.default_rng(7)
+    # Shrinking reuses the workspace grown by the first image
+    for shape in ((600, 800), (300, 200)):
+        img = rng.integers(0, 256, (*shape, 3), dtype=np.uint8)
+        assert band_features(fused, img, fused._workspace(img)) == band_features(masks, img, masks._workspace(img))
+
+def test_fused_features_match_masks_above_hist_chunk(detectors):
+    # Uniform rust-coloured image: every pixel falls in the same bin, whose
+    # count passes the float32-exact 2**24 that calcHist can hold
+    height, width = 4100, 4100
+    assert height * width > HIST_CHUNK_PIXELS
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = cv2.cvtColor(np.array([[[10, 200, 200]]], dtype=np.uint8), cv2.COLOR_HSV2BGR)[0, 0]
+    img[::97, ::89] = (255, 255, 255)
+
+    fused = band_features(detectors[True], img)
+    assert fused == band_features(detectors[False], img)
+    assert fused['rust_percentage'] > 95
+
+def test_fused_batch_features_match_masks(detectors):
+    rng = np.random.default_rng(11)
+    images = [rng.integers(0, 256, (*shape, 3), dtype=np.uint8) for shape in ((50, 70), (1, 1), (300, 400))]
+    fused = detectors[True]._extract_features_batch(images)
+    masks = detectors[False]._extract_features_batch(images)
+    for band in COLOR_BANDS:
+        assert np.array_equal(fused[f'{band}_percentage'], masks[f'{band}_percentage']), band
+
+@pytest.mark.parametrize('rules', [
+    {'disease_id': 'healthy'},
+    ['healthy'],
+    [{'weights': {}}],
+    [{'disease_id': ['healthy'], 'weights': {}}],
+    [{'disease_id': 'healthy', 'weights': [1, 2]}],
+    [{'disease_id': 'healthy', 'weights': {}, 'bias': None}],
+    [{'disease_id': 'healthy', 'weights': {'avg_hue': '2'}}],
+])
+def test_malformed_scoring_rules_raise_value_error(rules):
+    with pytest.raises(ValueError):
+        compile_scoring_rules(rules, {'healthy'})
@@ -0,0 +1,44 @@
+import json
+import os
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+from catalogue import DATA_DIR, load_catalogue
+from inference_pool import CATALOGUE_FILES_KEPT, InferencePool
+
+@pytest.fixture
+def pool():
+    pool = InferencePool(workers=1)
+    yield pool
+    pool.shutdown()
+
+def edited_catalogues(tmp_path, count):
+    """count snapshots of data/ with a different disease description each"""
+    data_dir = tmp_path / 'data'
+    shutil.copytree(DATA_DIR, data_dir)
+    path = data_dir / 'diseases.json'
+    for i in range(count):
+        data = json.loads(path.read_text())
+        data['diseases'][0]['description'] = f'Edit {i}'
+        path.write_text(json.dumps(data))
+        yield load_catalogue(data_dir)
+
+def test_jobs_carry_the_catalogue_version_not_the_snapshot(pool, tmp_path):
+    leaf = np.full((120, 160, 3), (40, 70, 110), dtype=np.uint8)
+    cv2.ellipse(leaf, (80, 60), (60, 40), 0, 0, 360, (40, 150, 60), -1)
+    image = cv2.imencode('.jpg', leaf)[1].tobytes()
+    snapshots = list(edited_catalogues(tmp_path, CATALOGUE_FILES_KEPT + 2))
+
+    pool.set_catalogue(snapshots[0])
+    first = pool.analyze_image(image)
+    for snapshot in snapshots[1:]:
+        pool.set_catalogue(snapshot)
+
+    version, path = pool._catalogue
+    assert version == snapshots[-1].version
+    assert len(os.listdir(os.path.dirname(path))) == CATALOGUE_FILES_KEPT
+    # The worker reads the newest file once it sees the new version
+    assert pool.analyze_image(image) == first
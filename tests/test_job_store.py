@@ -0,0 +1,22 @@
+import time
+
+from job_store import SharedJobStore
+
+def test_retries_do_not_join_a_stalled_job(tmp_path):
+    store = SharedJobStore(str(tmp_path / 'jobs.sqlite3'), stale_seconds=0.2)
+    job, created = store.create('photo')
+    assert created
+    assert store.create('photo') == (job, False)
+
+    time.sleep(0.3)
+    retry, created = store.create('photo')
+    assert created and retry['job_id'] != job['job_id']
+
+def test_finished_jobs_are_joined_however_old(tmp_path):
+    store = SharedJobStore(str(tmp_path / 'jobs.sqlite3'), stale_seconds=0.2)
+    job, _ = store.create('photo')
+    store.finish(job['job_id'], {'disease_id': 'healthy'})
+
+    time.sleep(0.3)
+    again, created = store.create('photo')
+    assert not created and again['job_id'] == job['job_id']
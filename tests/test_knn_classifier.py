@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from disease_detector import FEATURE_NAMES, DiseaseDetector, feature_settings
+from knn_classifier import KNNClassifier
+
+@pytest.fixture(scope='module')
+def labelled():
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(2000, len(FEATURE_NAMES))) * rng.uniform(1, 50, len(FEATURE_NAMES))
+    labels = [f'disease_{i % 4}' for i in range(len(vectors))]
+    return vectors, labels
+
+def test_neighbours_match_brute_force(labelled):
+    vectors, labels = labelled
+    classifier = KNNClassifier(vectors, labels, k=5, leaf_size=16)
+    queries = np.random.default_rng(4).normal(size=(300, len(FEATURE_NAMES))) * vectors.std(axis=0)
+
+    distances, _ = classifier.kneighbors(queries)
+    standardized = (vectors - vectors.mean(axis=0)) / vectors.std(axis=0)
+    expected = np.sort(
+        np.square(((queries - vectors.mean(axis=0)) / vectors.std(axis=0))[:, None] - standardized).sum(axis=2),
+        axis=1
+    )[:, :5]
+    assert np.allclose(distances, expected, rtol=1e-3, atol=1e-3)
+
+def test_fewer_samples_than_k():
+    classifier = KNNClassifier(np.eye(len(FEATURE_NAMES))[:2], ['a', 'b'], k=5)
+    distances, labels = classifier.kneighbors(np.zeros((1, len(FEATURE_NAMES))))
+    assert (labels[0, 2:] == -1).all() and np.isinf(distances[0, 2:]).all()
+
+def test_settings_survive_save_and_load(labelled, tmp_path):
+    vectors, labels = labelled
+    settings = feature_settings(max_pixels=2_000_000, crop_leaf=True)
+    classifier = KNNClassifier(vectors, labels, settings=settings)
+    classifier.save(tmp_path / 'model.npz')
+
+    loaded = KNNClassifier.load(tmp_path / 'model.npz')
+    assert loaded.settings == settings
+    assert loaded.version == classifier.version
+
+def test_model_without_settings_is_refused(labelled, tmp_path):
+    vectors, labels = labelled
+    arrays = dict(KNNClassifier(vectors, labels)._arrays)
+    del arrays['crop_leaf']
+    np.savez(tmp_path / 'old.npz', **arrays)
+    with pytest.raises(ValueError, match='feature settings'):
+        KNNClassifier.load(tmp_path / 'old.npz')
+
+def test_detector_refuses_mismatched_model(labelled):
+    vectors, labels = labelled
+    classifier = KNNClassifier(vectors, labels, settings=feature_settings(crop_leaf=True))
+    catalogue = DiseaseDetector().catalogue
+
+    DiseaseDetector(crop_leaf=True, classifier=classifier, catalogue=catalogue)
+    with pytest.raises(ValueError, match='rebuild'):
+        DiseaseDetector(crop_leaf=False, classifier=classifier, catalogue=catalogue)
+    with pytest.raises(ValueError, match='rebuild'):
+        DiseaseDetector(crop_leaf=True, max_pixels=1_000_000, classifier=classifier, catalogue=catalogue)
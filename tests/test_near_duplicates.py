@@ -0,0 +1,19 @@
+import cv2
+import numpy as np
+
+from disease_detector import DiseaseDetector
+from near_duplicates import NearDuplicateIndex
+
+def leaf(center):
+    img = np.full((480, 640, 3), (40, 70, 110), dtype=np.uint8)
+    cv2.ellipse(img, center, (250, 150), 15, 0, 360, (40, 150, 60), -1)
+    return img
+
+def test_reused_result_keeps_the_first_shots_leaf_region():
+    detector = DiseaseDetector(crop_leaf=True, near_duplicates=NearDuplicateIndex())
+    first = detector.analyze_image(leaf((320, 240)))
+    second = detector.analyze_image(leaf((322, 240)))
+
+    assert 'reused' not in first
+    assert second['reused'] is True
+    assert second['leaf_region'] == first['leaf_region']
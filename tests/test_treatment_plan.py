@@ -0,0 +1,44 @@
+import pytest
+
+from treatment_advisor import TreatmentAdvisor, compile_chemical_index
+
+@pytest.fixture(scope='module')
+def advisor():
+    return TreatmentAdvisor()
+
+@pytest.fixture(scope='module')
+def valid_row(advisor):
+    disease_id, _ = next(iter(advisor.catalogue.chemical_index))
+    chemical = advisor.get_inorganic_options(disease_id)['available_chemicals'][0]['name']
+    return {'disease_id': disease_id, 'chemical_name': chemical, 'motor_capacity': 15}
+
+@pytest.mark.parametrize('changes, error', [
+    ({'disease_id': ['x']}, 'disease_id must be a string'),
+    ({'disease_id': {'a': 1}}, 'disease_id must be a string'),
+    ({'motor_capacity': 'nan'}, 'Invalid numeric values'),
+    ({'water_amount': float('inf')}, 'Invalid numeric values'),
+    ({'field_area': 'inf'}, 'Invalid numeric values'),
+    ({'spray_volume': '-inf'}, 'Invalid numeric values'),
+    ({'field_area': 0}, 'Amounts must be positive'),
+    ({'field_area': -1}, 'Amounts must be positive'),
+])
+def test_bad_rows_are_reported_per_row(advisor, valid_row, changes, error):
+    plan = advisor.plan_spray_batch([dict(valid_row, **changes), valid_row])
+    assert plan['plans'][0] == {'row': 0, 'error': error}
+    assert plan['plans'][1]['tank_fills'] == 1
+    assert plan['totals']['planned_rows'] == 1
+    assert plan['totals']['failed_rows'] == 1
+
+def test_field_area_sets_tank_fills(advisor, valid_row):
+    plan = advisor.plan_spray_batch([dict(valid_row, field_area=0.5)], spray_volume_per_acre=200)
+    assert plan['plans'][0]['total_water'] == 100
+    assert plan['plans'][0]['tank_fills'] == 7
+
+@pytest.mark.parametrize('entries, error', [
+    (['Mancozeb'], 'must be an object'),
+    ([{'name': 'Mancozeb', 'active_ingredient': 'x', 'concentration': '75%', 'recommended_dose_per_liter': '2.5g',
+       'mixing_ratio': '1:400', 'safety_precautions': []}], "Mixing ratio for 'Mancozeb'"),
+])
+def test_malformed_chemicals_raise_value_error(entries, error):
+    with pytest.raises(ValueError, match=error):
+        compile_chemical_index({'leaf_blight': entries})
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+import pytest
+
+from disease_detector import DiseaseDetector
+
+@pytest.fixture(scope='module')
+def still_video(tmp_path_factory):
+    """25 s of one unchanging leaf at 10 fps, then 5 s of the leaf turned yellow"""
+    path = str(tmp_path_factory.mktemp('video') / 'still.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (160, 120))
+    if not writer.isOpened():
+        pytest.skip('OpenCV build cannot write MJPG video')
+
+    leaf = np.full((120, 160, 3), (40, 70, 110), dtype=np.uint8)
+    cv2.ellipse(leaf, (80, 60), (60, 40), 0, 0, 360, (40, 150, 60), -1)
+    yellowed = leaf.copy()
+    cv2.ellipse(yellowed, (80, 60), (60, 40), 0, 0, 360, (40, 200, 210), -1)
+
+    for frame in [leaf] * 250 + [yellowed] * 50:
+        writer.write(frame)
+    writer.release()
+    return path
+
+def test_segments_of_skipped_frames_are_diagnosed(still_video):
+    segments = list(DiseaseDetector().analyze_video(still_video, sample_fps=2, segment_seconds=10))
+
+    assert [s['segment'] for s in segments] == [0, 1, 2]
+    # Only the first frame of the still scene is analyzed; the later ones repeat it
+    assert segments[0]['frames_analyzed'] == 1
+    assert segments[1]['frames_analyzed'] == 0
+    assert segments[1]['frames_skipped'] == 20
+    assert segments[1]['disease_id'] == segments[0]['disease_id']
+    assert sum(segments[1]['votes'].values()) == 20
+    assert segments[2]['frames_analyzed'] == 1
+
+def test_frames_are_cropped_to_the_leaf(still_video):
+    cropped = next(DiseaseDetector(crop_leaf=True).analyze_video(still_video, sample_fps=2, segment_seconds=10))
+
+    capture = cv2.VideoCapture(still_video)
+    ok, frame = capture.read()
+    capture.release()
+    assert ok
+    expected = DiseaseDetector(crop_leaf=True).analyze_image(frame)
+    assert cropped['features'] == pytest.approx(expected['features'])
@@ -0,0 +1,243 @@
+"""
+Tiled Field Analysis
+Runs disease detection over large drone orthomosaics tile by tile, in
+parallel worker processes, and returns a per-tile heatmap of disease,
+severity and confidence plus a field-level summary.
+
+Mosaics saved as .npy (H x W x 3, uint8, BGR) are memory-mapped, so each
+worker reads only the tiles it analyzes and peak memory stays bounded by
+the tile size. Other formats are decoded whole with OpenCV in the parent
+process (H x W x 3 bytes held at once) and tiles are handed to the workers
+a few at a time. OpenCV refuses to decode images over CV_IO_MAX_IMAGE_PIXELS
+(default 2**30) pixels; such mosaics are rejected with an error up front.
+
+Large mosaics should be converted to .npy once. A GeoTIFF can be copied
+window by window without ever decoding it whole, e.g. with rasterio:
+
+    out = np.lib.format.open_memmap('field.npy', mode='w+', dtype=np.uint8, shape=(H, W, 3))
+    for each window: out[rows, cols] = src.read((3, 2, 1), window=window).transpose(1, 2, 0)
+
+Usage:
+    python tiled_analysis.py field.npy --tile 1024 --json field.json --heatmap field.png
+"""
+
+import argparse
+import json
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from disease_detector import DiseaseDetector
+
+SEVERITY_LEVELS = ['mild', 'moderate', 'severe']
+
+# OpenCV's own limit on decoded image size (overridable through the environment)
+CV_MAX_IMAGE_PIXELS = int(os.environ.get('CV_IO_MAX_IMAGE_PIXELS', 1 << 30))
+
+# Per-worker state, set up once by the pool initializer
+_tile_detector = None
+_tile_mosaic = None
+
+def open_mosaic(path):
+    """
+    Open a mosaic for tiling
+    Returns: BGR array; memory-mapped (read-only) for .npy files
+    Raises: ValueError if the file cannot be read, or is too large for OpenCV to decode
+    """
+    if Path(path).suffix.lower() == '.npy':
+        mosaic = np.load(path, mmap_mode='r')
+    else:
+        check_decodable(path)
+        mosaic = cv2.imread(str(path))
+        if mosaic is None:
+            raise ValueError(f'Could not read mosaic {path}')
+
+    if mosaic.ndim != 3 or mosaic.shape[2] != 3 or mosaic.dtype != np.uint8:
+        raise ValueError('Mosaic must be an H x W x 3 uint8 BGR image')
+    return mosaic
+
+def check_decodable(path):
+    """
+    Read the image header (without decoding pixels) and refuse mosaics
+    OpenCV would not decode, instead of letting imread fail silently
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    # Only the header is read, so Pillow's own decompression-bomb guard is lifted meanwhile
+    limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except (OSError, UnidentifiedImageError):
+        # Left to OpenCV, which reads some formats Pillow does not
+        return
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+    if width * height > CV_MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f'{path} is {width} x {height} = {width * height} pixels, over the '
+            f'{CV_MAX_IMAGE_PIXELS} OpenCV will decode (CV_IO_MAX_IMAGE_PIXELS); '
+            f'convert it to .npy to analyze it memory-mapped (see tiled_analysis.py)'
+        )
+
+def tile_grid(height, width, tile_size):
+    """Yield (row, col, y, x, h, w) for every tile covering the mosaic"""
+    for row, y in enumerate(range(0, height, tile_size)):
+        for col, x in enumerate(range(0, width, tile_size)):
+            yield row, col, y, x, min(tile_size, height - y), min(tile_size, width - x)
+
+def analyze_tile(detector, tile):
+    """
+    Classify one tile through the detector's full analysis, so its
+    max_pixels, crop_leaf and classifier apply as for uploads
+    Returns: {'disease_id', 'severity', 'confidence'}, or None for an empty (no-data) tile
+    """
+    if not tile.any():
+        return None
+
+    result = detector.analyze_image(tile)
+    if result is None:
+        return None
+    return {
+        'disease_id': result['disease_id'],
+        'severity': result['severity'],
+        'confidence': float(result['confidence'])
+    }
+
+def _init_tile_worker(mosaic_path, detector_options):
+    global _tile_detector, _tile_mosaic
+    _tile_detector = DiseaseDetector(**detector_options)
+    if mosaic_path is not None:
+        _tile_mosaic = open_mosaic(mosaic_path)
+
+def _run_tile(row, col, y, x, h, w, tile=None):
+    if tile is None:
+        # Memory-mapped: read only this tile's pixels
+        tile = np.ascontiguousarray(_tile_mosaic[y:y + h, x:x + w])
+    return row, col, analyze_tile(_tile_detector, tile)
+
+def analyze_tiled(path, tile_size=1024, workers=None, detector_options=None):
+    """
+    Analyze a mosaic tile by tile
+
+    Args:
+        path: Mosaic file (.npy is memory-mapped; anything OpenCV reads also works)
+        tile_size: Tile edge length in pixels
+        workers: Worker processes (defaults to the CPU count; 0 runs in-process)
+        detector_options: Keyword arguments for each worker's DiseaseDetector
+
+    Returns: Heatmap grids of disease_id / severity / confidence and a field summary
+    """
+    detector_options = detector_options or {}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    mosaic = open_mosaic(path)
+    memory_mapped = isinstance(mosaic, np.memmap)
+    height, width = mosaic.shape[:2]
+
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    grid = [[None] * cols for _ in range(rows)]
+
+    if workers == 0:
+        detector = DiseaseDetector(**detector_options)
+        for row, col, y, x, h, w in tile_grid(height, width, tile_size):
+            grid[row][col] = analyze_tile(detector, np.ascontiguousarray(mosaic[y:y + h, x:x + w]))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_tile_worker,
+            initargs=(str(path) if memory_mapped else None, detector_options)
+        ) as pool:
+            # Keep only a few tiles in flight so memory stays bounded
+            in_flight = set()
+            for row, col, y, x, h, w in tile_grid(height, width, tile_size):
+                tile = None if memory_mapped else np.ascontiguousarray(mosaic[y:y + h, x:x + w])
+                in_flight.add(pool.submit(_run_tile, row, col, y, x, h, w, tile))
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        r, c, tile_result = future.result()
+                        grid[r][c] = tile_result
+            for future in in_flight:
+                r, c, tile_result = future.result()
+                grid[r][c] = tile_result
+
+    return {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'rows': rows,
+        'cols': cols,
+        'heatmap': {
+            'disease_id': [[t['disease_id'] if t else None for t in line] for line in grid],
+            'severity': [[t['severity'] if t else None for t in line] for line in grid],
+            'confidence': [[t['confidence'] if t else None for t in line] for line in grid]
+        },
+        'summary': summarize(grid)
+    }
+
+def summarize(grid):
+    """Field-level summary over all analyzed (non-empty) tiles"""
+    tiles = [t for line in grid for t in line if t]
+    if not tiles:
+        return {'analyzed_tiles': 0, 'empty_tiles': sum(len(line) for line in grid)}
+
+    diseases = Counter(t['disease_id'] for t in tiles)
+    severities = Counter(t['severity'] for t in tiles)
+    dominant, dominant_count = diseases.most_common(1)[0]
+
+    return {
+        'analyzed_tiles': len(tiles),
+        'empty_tiles': sum(len(line) for line in grid) - len(tiles),
+        'dominant_disease': dominant,
+        'dominant_share': round(dominant_count / len(tiles), 4),
+        'disease_share': {d: round(n / len(tiles), 4) for d, n in diseases.most_common()},
+        'severity_share': {s: round(severities.get(s, 0) / len(tiles), 4) for s in SEVERITY_LEVELS},
+        'mean_confidence': round(sum(t['confidence'] for t in tiles) / len(tiles), 2)
+    }
+
+def render_heatmap(report, cell_size=16):
+    """Draw the disease grid as an image: one color per disease, brightness by confidence"""
+    disease_ids = sorted({d for line in report['heatmap']['disease_id'] for d in line if d})
+    hues = {d: int(180 * i / max(1, len(disease_ids))) for i, d in enumerate(disease_ids)}
+
+    hsv = np.zeros((report['rows'], report['cols'], 3), dtype=np.uint8)
+    for r, line in enumerate(report['heatmap']['disease_id']):
+        for c, disease_id in enumerate(line):
+            if disease_id:
+                confidence = report['heatmap']['confidence'][r][c]
+                hsv[r, c] = (hues[disease_id], 255, int(80 + 175 * min(confidence, 100) / 100))
+
+    img = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+    return cv2.resize(img, None, fx=cell_size, fy=cell_size, interpolation=cv2.INTER_NEAREST)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tiled disease heatmap for large field mosaics')
+    parser.add_argument('mosaic', help='Mosaic image (.npy is memory-mapped)')
+    parser.add_argument('--tile', type=int, default=1024, help='Tile size in pixels')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count, 0 = in-process)')
+    parser.add_argument('--json', help='Write the full report to this file')
+    parser.add_argument('--heatmap', help='Write a heatmap image to this file')
+    parser.add_argument('--max-pixels', type=int, help='Downsample larger tiles before analysis')
+    parser.add_argument('--crop-leaf', action='store_true', help='Analyze only the leaf region of each tile')
+    args = parser.parse_args()
+
+    try:
+        report = analyze_tiled(args.mosaic, tile_size=args.tile, workers=args.workers, detector_options={
+            'max_pixels': args.max_pixels, 'crop_leaf': args.crop_leaf, 'reuse_buffers': True
+        })
+    except ValueError as e:
+        raise SystemExit(e)
+    print(json.dumps(report['summary'], indent=2))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f)
+    if args.heatmap:
+        cv2.imwrite(args.heatmap, render_heatmap(report))
@@ -1,21 +1,106 @@
-import json
+import math
+import re
+import numpy as np
 from pathlib import Path
 
-class TreatmentAdvisor:
-    def __init__(self):
-        # Load treatment databases
-        with open('data/organic_recipes.json', 'r') as f:
-            self.organic_data = json.load(f)
+# "2.5g", "0.5 ml", "3" (unitless doses are grams)
+DOSE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(g|ml)?\s*$', re.IGNORECASE)
+# "1:400" chemical parts to water parts
+RATIO_PATTERN = re.compile(r'^\s*(\d+)\s*:\s*(\d+)\s*$')
+
+# Liters of spray solution applied per acre when a plan row does not say
+DEFAULT_SPRAY_VOLUME_PER_ACRE = 200
+
+CHEMICAL_FIELDS = ('name', 'active_ingredient', 'concentration', 'recommended_dose_per_liter',
+                   'mixing_ratio', 'safety_precautions')
+RECIPE_FIELDS = ('name', 'ingredients', 'preparation', 'application')
+
+def normalize_chemical_name(name):
+    """Lookup form of a chemical name: case-folded with whitespace collapsed"""
+    return ' '.join(name.split()).casefold()
+
+def compile_chemical_index(chemicals):
+    """
+    Validate the inorganic catalogue and pre-parse every dose and ratio
+    
+    Args:
+        chemicals: disease_id -> list of chemical entries (inorganic_chemicals.json)
+    
+    Returns: (disease_id, normalized name) -> {'chemical', 'dose_value', 'dose_unit',
+             'chemical_parts', 'water_parts'}, and disease_id -> chemical names
+    """
+    index = {}
+    names = {}
+    
+    for disease_id, entries in chemicals.items():
+        if not isinstance(entries, list):
+            raise ValueError(f"Chemicals for '{disease_id}' must be a list")
+        names[disease_id] = []
         
-        with open('data/inorganic_chemicals.json', 'r') as f:
-            self.inorganic_data = json.load(f)
+        for position, chemical in enumerate(entries):
+            if not isinstance(chemical, dict):
+                raise ValueError(f"Chemical #{position} for '{disease_id}' must be an object")
+            missing = [field for field in CHEMICAL_FIELDS if field not in chemical]
+            if missing:
+                raise ValueError(f"Chemical {chemical.get('name')!r} for '{disease_id}' is missing {missing}")
+            if not isinstance(chemical['name'], str):
+                raise ValueError(f"Chemical name {chemical['name']!r} for '{disease_id}' must be a string")
+            if not isinstance(chemical['mixing_ratio'], dict):
+                raise ValueError(f"Mixing ratio for '{chemical['name']}' must be an object, "
+                                 f"got {chemical['mixing_ratio']!r}")
+            
+            dose = DOSE_PATTERN.match(str(chemical['recommended_dose_per_liter']))
+            if not dose:
+                raise ValueError(f"Unparseable dose {chemical['recommended_dose_per_liter']!r} "
+                                 f"for '{chemical['name']}'")
+            ratio = RATIO_PATTERN.match(str(chemical['mixing_ratio'].get('chemical_to_water', '')))
+            if not ratio:
+                raise ValueError(f"Unparseable mixing ratio {chemical['mixing_ratio']!r} for '{chemical['name']}'")
+            
+            key = (disease_id, normalize_chemical_name(chemical['name']))
+            if key in index:
+                raise ValueError(f"Duplicate chemical '{chemical['name']}' for '{disease_id}'")
+            index[key] = {
+                'chemical': chemical,
+                'dose_value': float(dose.group(1)),
+                'dose_unit': (dose.group(2) or 'g').lower(),
+                'chemical_parts': int(ratio.group(1)),
+                'water_parts': int(ratio.group(2))
+            }
+            names[disease_id].append(chemical['name'])
+    
+    return index, names
+
+def validate_recipes(recipes):
+    """Raise ValueError if an organic recipe is missing a required field"""
+    for disease_id, recipe in recipes.items():
+        missing = [field for field in RECIPE_FIELDS if field not in recipe]
+        if missing:
+            raise ValueError(f"Organic recipe for '{disease_id}' is missing {missing}")
+
+class TreatmentAdvisor:
+    def __init__(self, catalogue=None):
+        """
+        Args:
+            catalogue: CatalogueSnapshot to start with (defaults to loading data/).
+                       Loading validates recipes and pre-parses doses, so bad data
+                       fails at startup, not mid-request.
+        """
+        if catalogue is None:
+            from catalogue import load_catalogue
+            catalogue = load_catalogue()
+        self.catalogue = catalogue
+    
+    def set_catalogue(self, catalogue):
+        """Switch to another CatalogueSnapshot; calls in progress keep the one they started with"""
+        self.catalogue = catalogue
     
     def get_organic_treatment(self, disease_id):
         """
         Get organic fertilizer recipe for a disease
         Returns: Complete recipe with ingredients, preparation, and application
         """
-        recipe = self.organic_data['recipes'].get(disease_id)
+        recipe = self.catalogue.organic_data['recipes'].get(disease_id)
         
         if not recipe:
             return {
@@ -34,7 +119,7 @@ class TreatmentAdvisor:
         Get list of available inorganic chemicals for a disease
         Returns: List of chemical options
         """
-        chemicals = self.inorganic_data['chemicals'].get(disease_id, [])
+        chemicals = self.catalogue.inorganic_data['chemicals'].get(disease_id, [])
         
         if not chemicals:
             return {
@@ -60,20 +145,16 @@ class TreatmentAdvisor:
         
         Returns: Detailed mixing instructions with amounts
         """
-        # Get chemical options for this disease
-        chemicals = self.inorganic_data['chemicals'].get(disease_id, [])
-        
         # Find the specific chemical
-        chemical = next(
-            (c for c in chemicals if c['name'].lower() == chemical_name.lower()),
-            None
-        )
+        catalogue = self.catalogue
+        entry = catalogue.chemical_index.get((disease_id, normalize_chemical_name(chemical_name)))
         
-        if not chemical:
+        if not entry:
             return {
                 'error': f'Chemical "{chemical_name}" not found for this disease',
-                'available_chemicals': [c['name'] for c in chemicals]
+                'available_chemicals': list(catalogue.chemical_names.get(disease_id, []))
             }
+        chemical = entry['chemical']
         
         # Use motor capacity as water amount if not specified
         if water_liters is None:
@@ -85,27 +166,14 @@ class TreatmentAdvisor:
                 'error': f'Water amount ({water_liters}L) exceeds motor capacity ({motor_capacity_liters}L)'
             }
         
-        # Calculate chemical amount based on recommended dose per liter
+        # Dose and ratio were parsed when the catalogue was loaded
         dose_per_liter = chemical['recommended_dose_per_liter']
-        
-        # Extract numeric value and unit
-        if 'g' in dose_per_liter:
-            dose_value = float(dose_per_liter.replace('g', ''))
-            dose_unit = 'g'
-        elif 'ml' in dose_per_liter:
-            dose_value = float(dose_per_liter.replace('ml', ''))
-            dose_unit = 'ml'
-        else:
-            dose_value = float(dose_per_liter)
-            dose_unit = 'g'
+        dose_unit = entry['dose_unit']
+        chemical_parts = entry['chemical_parts']
+        water_parts = entry['water_parts']
         
         # Calculate total chemical needed
-        total_chemical = dose_value * water_liters
-        
-        # Calculate mixing ratio
-        ratio_parts = chemical['mixing_ratio']['chemical_to_water'].split(':')
-        chemical_parts = int(ratio_parts[0])
-        water_parts = int(ratio_parts[1])
+        total_chemical = entry['dose_value'] * water_liters
         
         return {
             'treatment_type': 'inorganic',
@@ -136,6 +204,112 @@ class TreatmentAdvisor:
             'recommended_dose_per_liter': dose_per_liter
         }
     
+    def plan_spray_batch(self, rows, spray_volume_per_acre=DEFAULT_SPRAY_VOLUME_PER_ACRE):
+        """
+        Plan spraying for many fields at once
+        
+        Args:
+            rows: Dicts with disease_id, chemical_name, motor_capacity and optional
+                  water_amount (liters per tank fill, defaults to motor_capacity),
+                  field_area (acres; without it the row is one tank fill) and
+                  spray_volume (liters per acre)
+            spray_volume_per_acre: Spray volume for rows that do not give one
+        
+        Returns: Per-row plans (or {'row', 'error'} for rows that cannot be planned)
+                 and totals over the valid rows
+        """
+        catalogue = self.catalogue
+        results = [None] * len(rows)
+        valid = []
+        entries = []
+        numbers = []
+        
+        # Validate every row first; errors stay with their row
+        for i, row in enumerate(rows):
+            try:
+                entry, values = self._parse_plan_row(row, spray_volume_per_acre, catalogue)
+            except ValueError as e:
+                results[i] = {'row': i, 'error': str(e)}
+                continue
+            valid.append(i)
+            entries.append(entry)
+            numbers.append(values)
+        
+        totals = {'rows': len(rows), 'planned_rows': len(valid), 'failed_rows': len(rows) - len(valid),
+                  'tank_fills': 0, 'total_water': 0.0, 'total_chemical': {}}
+        if not valid:
+            return {'treatment_type': 'inorganic', 'plans': results, 'totals': totals}
+        
+        # One vectorized pass over every valid row
+        capacity, water, area, volume, has_area = np.array(numbers, dtype=np.float64).T
+        dose = np.array([entry['dose_value'] for entry in entries])
+        total_water = np.where(has_area > 0, area * volume, water)
+        fills = np.maximum(1, np.ceil(np.round(total_water / water, 9))).astype(np.int64)
+        per_fill = dose * water
+        total_chemical = dose * total_water
+        
+        for j, (i, entry) in enumerate(zip(valid, entries)):
+            row = rows[i]
+            results[i] = {
+                'row': i,
+                'disease_id': row['disease_id'],
+                'chemical_name': entry['chemical']['name'],
+                'motor_capacity': float(capacity[j]),
+                'field_area': float(area[j]) if has_area[j] else None,
+                'water_per_fill': float(water[j]),
+                'chemical_per_fill': round(float(per_fill[j]), 2),
+                'chemical_unit': entry['dose_unit'],
+                'tank_fills': int(fills[j]),
+                'total_water': round(float(total_water[j]), 2),
+                'total_chemical': round(float(total_chemical[j]), 2),
+                'mixing_ratio': f"{entry['chemical_parts']}:{entry['water_parts']}"
+            }
+        
+        totals['tank_fills'] = int(fills.sum())
+        totals['total_water'] = round(float(total_water.sum()), 2)
+        units = np.array([entry['dose_unit'] for entry in entries])
+        for unit in sorted(set(units)):
+            totals['total_chemical'][unit] = round(float(total_chemical[units == unit].sum()), 2)
+        
+        return {'treatment_type': 'inorganic', 'plans': results, 'totals': totals}
+    
+    def _parse_plan_row(self, row, spray_volume_per_acre, catalogue):
+        """
+        Check one plan row
+        Returns: (chemical index entry, [capacity, water, area, spray volume, has area])
+        Raises: ValueError describing what is wrong with the row
+        """
+        if not isinstance(row, dict):
+            raise ValueError('Row must be an object')
+        if not all(row.get(field) for field in ('disease_id', 'chemical_name', 'motor_capacity')):
+            raise ValueError('disease_id, chemical_name, and motor_capacity are required')
+        if not isinstance(row['disease_id'], str):
+            raise ValueError('disease_id must be a string')
+        
+        entry = catalogue.chemical_index.get((row['disease_id'], normalize_chemical_name(str(row['chemical_name']))))
+        if not entry:
+            raise ValueError(f'Chemical "{row["chemical_name"]}" not found for this disease')
+        
+        has_area = row.get('field_area') is not None
+        try:
+            capacity = float(row['motor_capacity'])
+            water = float(row['water_amount']) if row.get('water_amount') else capacity
+            area = float(row['field_area']) if has_area else 0.0
+            volume = float(row['spray_volume']) if row.get('spray_volume') else float(spray_volume_per_acre)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid numeric values')
+        
+        # float() accepts "nan" and "inf", which would poison the totals
+        if not all(math.isfinite(x) for x in (capacity, water, area, volume)):
+            raise ValueError('Invalid numeric values')
+        # A given field_area of 0 would plan one tank fill of 0 L
+        if capacity <= 0 or water <= 0 or (has_area and area <= 0) or volume <= 0:
+            raise ValueError('Amounts must be positive')
+        if water > capacity:
+            raise ValueError(f'Water amount ({water}L) exceeds motor capacity ({capacity}L)')
+        
+        return entry, [capacity, water, area, volume, has_area]
+    
     def get_treatment_summary(self, disease_id, treatment_type, **kwargs):
         """
         Get complete treatment recommendation based on type
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Leading bytes of the image formats we accept -> stored file extension
+MAGIC_EXTENSIONS = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+)
+
+# Temp files older than this are left over from a crashed write
+STALE_TEMP_SECONDS = 3600
+
+def sniff_extension(data):
+    """File extension for image bytes, decided by content so identical bytes always map to one path"""
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    for magic, extension in MAGIC_EXTENSIONS:
+        if data.startswith(magic):
+            return extension
+    return '.bin'
+
+class UploadStore:
+    """
+    Content-addressed store for uploaded images. Each image is written once,
+    to <root>/<ab>/<cd>/<sha256><ext>, so identical uploads share a file and
+    concurrent uploads with the same filename cannot overwrite each other.
+    Writes go to a temp file in the target directory and are renamed into
+    place. A background sweeper evicts images by age and, oldest first,
+    whenever the store grows past max_bytes.
+    """
+
+    def __init__(self, root, max_bytes=None, max_age_seconds=None, sweep_interval=600):
+        """
+        Args:
+            root: Directory holding the shard directories
+            max_bytes: Total size the store is trimmed back to (None = unlimited)
+            max_age_seconds: Images not uploaded again for this long are evicted (None = keep)
+            sweep_interval: Seconds between background sweeps once start() is called
+        """
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.Lock()
+        self._counters = {'writes': 0, 'duplicates': 0, 'evictions': 0, 'evicted_bytes': 0}
+        # Bytes written since the last sweep; a sweep runs early once this would pass max_bytes
+        self._bytes = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def path_for(self, digest, extension):
+        return self.root / digest[:2] / digest[2:4] / f'{digest}{extension}'
+
+    def put(self, data):
+        """
+        Store image bytes unless an identical image is already stored
+        Returns: (sha256 hex digest, path, created) where created is False for a duplicate
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, sniff_extension(data))
+
+        if path.exists():
+            # Re-uploaded images count as fresh for age-based eviction
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            else:
+                with self._lock:
+                    self._counters['duplicates'] += 1
+                return digest, path, False
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # Atomic on POSIX and Windows: readers see the whole file or none of it
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._counters['writes'] += 1
+            if self._bytes is not None:
+                self._bytes += len(data)
+                if self.max_bytes is not None and self._bytes > self.max_bytes:
+                    self._wake.set()
+        return digest, path, True
+
+    def sweep(self):
+        """
+        Evict images past max_age_seconds, then the oldest images until the
+        store fits in max_bytes, and remove temp files left by crashed writes
+        Returns: Number of images evicted
+        """
+        now = time.time()
+        files = []
+        for path in self._stored_files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.name.endswith('.tmp'):
+                if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    self._remove(path, 0)
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for mtime, size, path in files:
+            too_old = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                # Sorted oldest first: nothing after this is older or needed for the size cap
+                break
+            if self._remove(path, size):
+                evicted += 1
+            total -= size
+
+        with self._lock:
+            self._bytes = total
+        return evicted
+
+    def stats(self):
+        """Write, deduplication and eviction counters, plus the stored size at the last sweep"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+            return stats
+
+    def start(self):
+        """Sweep once now, then every sweep_interval seconds (or early when full), in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='upload-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except OSError:
+                # Storage trouble must not kill the sweeper; try again next round
+                pass
+            self._wake.wait(self.sweep_interval)
+            self._wake.clear()
+
+    def _stored_files(self):
+        # Only the two-level shard directories: anything else under root is left alone
+        if not self.root.is_dir():
+            return
+        for first in self.root.iterdir():
+            if len(first.name) != 2 or not first.is_dir():
+                continue
+            for second in first.iterdir():
+                if len(second.name) == 2 and second.is_dir():
+                    yield from second.iterdir()
+
+    def _remove(self, path, size):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            # Another worker's sweeper got there first
+            return False
+        with self._lock:
+            self._counters['evictions'] += 1
+            self._counters['evicted_bytes'] += size
+        return True